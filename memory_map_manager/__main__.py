@@ -12,9 +12,11 @@ import logging
 from os import path, makedirs, remove
 
 from memory_map_manager import MMMImporter, MMMExporter, MMMConfigParser
+from memory_map_manager.profiler import PhaseProfiler, profile_phase
+from memory_map_manager.watcher import FileWatcher
 
 
-def _write_files(files: dict, fdir, clean, exts):
+def _write_files(files: dict, fdir, clean, exts, written=None):
     if not path.exists(fdir):
         makedirs(fdir)
     elif clean:
@@ -24,11 +26,81 @@ def _write_files(files: dict, fdir, clean, exts):
                 remove(filename)
     for fname, fdata in files.items():
         fpath = path.join(fdir, fname)
+        if written is not None:
+            if written.get(fpath) == fdata and path.exists(fpath):
+                logging.debug("Skipping unchanged %r", fpath)
+                continue
+            written[fpath] = fdata
         logging.info("Creating %r", fpath)
         with open(fpath, 'w', encoding="utf-8") as fhandle:
             fhandle.write(fdata)
 
 
+def _generate(importer, clean, profiler=None, state=None):
+    """Generate the outputs.
+
+    The state is kept from one generation to the next when watching, it holds
+    the ``written`` files, the ``resolved_steps`` of the parser and the
+    ``map_cache`` of the exporter, so only changed maps are resolved and
+    rendered again.
+    """
+    state = {} if state is None else state
+    parser = MMMConfigParser(importer.mm_data, jobs=importer.jobs,
+                             profiler=profiler,
+                             resolved_steps=state.get('resolved_steps'))
+    exporter = MMMExporter(parser.get_cfg(), importer.mm_data,
+                           profiler=profiler,
+                           map_cache=state.get('map_cache'))
+    outputs = ((importer.c_dir, exporter.gen_c_files, ['c', 'h']),
+               (importer.csv_dir, exporter.gen_csv_files, ['csv']),
+               (importer.cfg_dir, exporter.gen_cfg_files, ['yaml']))
+    for fdir, gen_files, exts in outputs:
+        if fdir:
+            files = gen_files()
+            with profile_phase(profiler, 'write_files'):
+                _write_files(files, fdir, clean, exts, state.get('written'))
+    if not importer.c_dir and not importer.csv_dir and not importer.cfg_dir:
+        logging.warning("No directories to output specified")
+    else:
+        print("SUCCESS")
+    state['resolved_steps'] = parser.resolved_steps
+    state['map_cache'] = exporter.map_cache
+
+
+def _watch(importer, cfg_path, interval, state):
+    """Regenerate outputs when the configuration or map files change.
+
+    Only changed map files are imported again and generation is skipped if
+    the merged map data did not change. Unchanged files keep their data, so
+    only the changed data is compared. The defines and metadata are only
+    resolved again if they changed and maps are only resolved again if their
+    typedefs, overrides, defines or array uids changed. The outputs of
+    unchanged maps are not rendered again and files with unchanged content
+    are not rewritten.
+    """
+    watcher = FileWatcher([cfg_path] + importer.map_files, interval)
+    mm_data = importer.mm_data
+    logging.info("Watching %r for changes", cfg_path)
+    try:
+        while True:
+            changed = watcher.wait()
+            logging.info("Detected changes in %r", changed)
+            try:
+                if str(cfg_path) in changed:
+                    importer.import_cfg_file(cfg_path)
+                    watcher.set_paths([cfg_path] + importer.map_files)
+                importer.import_map_data()
+                if importer.mm_data == mm_data:
+                    logging.info("Map data did not change")
+                    continue
+                _generate(importer, False, state=state)
+                mm_data = importer.mm_data
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.error("Generation failed: %r", exc)
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+
+
 def main():
     """Parse typedefs and create outputs."""
     log_levels = ('debug', 'info', 'warning', 'error', 'fatal', 'critical')
@@ -44,6 +116,27 @@ def main():
                         help='clean the generated directories before '
                              'generation. Be careful!')
 
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help='amount of processes used to load the map '
+                             'files and resolve the generated maps, '
+                             'defaults to running serially')
+
+    parser.add_argument("--watch", "-w", action="store_true",
+                        help='keep running and regenerate when the '
+                             'configuration or map files change')
+
+    parser.add_argument("--watch-interval", type=float, default=0.5,
+                        help='seconds between checking for changes when '
+                             'watching, defaults to 0.5')
+
+    parser.add_argument("--profile", action="store_true",
+                        help='print the wall time and peak memory of each '
+                             'phase of the generation')
+
+    parser.add_argument("--profile-stats", metavar="FILE", default=None,
+                        help='also dump cProfile stats of the generation '
+                             'to FILE for pstats, implies --profile')
+
     parser.add_argument('--loglevel', choices=log_levels, default='info',
                         help='python logger log level, defaults to "info"')
     args = parser.parse_args()
@@ -52,23 +145,20 @@ def main():
     logging.info("Starting memory_map_manager")
 
     logging.info("Using %r for importer", args.cfg_path)
-    importer = MMMImporter(args.cfg_path)
-
-    parser = MMMConfigParser(importer.mm_data)
-    exporter = MMMExporter(parser.get_cfg(), importer.mm_data)
-    if importer.c_dir:
-        _write_files(exporter.gen_c_files(), importer.c_dir,
-                     args.clean, ['c', 'h'])
-    if importer.csv_dir:
-        _write_files(exporter.gen_csv_files(), importer.csv_dir,
-                     args.clean, ['csv'])
-    if importer.cfg_dir:
-        _write_files(exporter.gen_cfg_files(), importer.cfg_dir,
-                     args.clean, ['yaml'])
-    if not importer.c_dir and not importer.csv_dir and not importer.cfg_dir:
-        logging.warning("No directories to output specified")
-    else:
-        print("SUCCESS")
+    profiler = None
+    if args.profile or args.profile_stats:
+        profiler = PhaseProfiler(args.profile_stats)
+        profiler.start()
+    importer = MMMImporter(args.cfg_path, jobs=args.jobs, profiler=profiler)
+    state = {'written': {}} if args.watch else None
+    _generate(importer, args.clean, profiler, state)
+    if profiler is not None:
+        profiler.stop()
+        # Only the first generation is profiled when watching
+        importer.profiler = None
+        print(profiler.report())
+    if args.watch:
+        _watch(importer, args.cfg_path, args.watch_interval, state)
 
 
 if __name__ == "__main__":  # pragma: no cover
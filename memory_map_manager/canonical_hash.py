@@ -0,0 +1,251 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Streaming canonical hashing of configuration data.
+
+The compatibility mode gives the same digests as
+:func:`memory_map_manager.json_sem_hash.get_json_sem_hash` without building
+the sorted string copy of the data it hashes.
+"""
+from collections.abc import Mapping
+import hashlib
+import json
+
+_FLUSH_SIZE = 1 << 14
+_encode_json_str = json.encoder.encode_basestring
+_SCALARS = (str, int, float, type(None))
+
+
+class CanonicalWriter():
+    """Feeds the canonical encoding of data to a hasher in chunks.
+
+    In compatibility mode the encoding is exactly
+    ``repr(_sorted_dict_str(data))`` of :mod:`json_sem_hash` so the digests
+    stay the same, otherwise it is JSON with sorted keys, which keeps the
+    types of values apart. Mappings that are not dicts are encoded like
+    dicts.
+
+    The items of the outer lists and mappings are encoded one at a time and
+    fed to the hasher in chunks, so only small parts of the encoding exist at
+    any time.
+
+    Example:
+        >>> writer = CanonicalWriter(hashlib.md5())
+        >>> writer.encode({'b': [1, None], 'a': 'x'})
+        "{'a': 'x', 'b': ['1', 'None']}"
+        >>> CanonicalWriter(hashlib.md5(), compat=False).encode({'a': 1})
+        '{"a":1}'
+    """
+
+    def __init__(self, hasher, compat=True):
+        """Instantiate the writer.
+
+        Args:
+            hasher: A :mod:`hashlib` hash object the encoding is fed to.
+            compat: Use the encoding of :mod:`json_sem_hash`.
+        """
+        self.hasher = hasher
+        """The hash object the encoding is fed to."""
+
+        self.compat = compat
+        """Use the encoding of :mod:`json_sem_hash`."""
+
+        self._parts = []
+        self._size = 0
+        self._sep = ', ' if compat else ','
+        self._key = self._compat_key if compat else self._json_key
+        self._leaf = self._compat_leaf if compat else self._json_leaf
+        self._keys = {}
+
+    def add(self, part: str):
+        """Buffer a part of the encoding, feeding the hasher when full."""
+        self._parts.append(part)
+        self._size += len(part)
+        if self._size > _FLUSH_SIZE:
+            self.flush()
+
+    def add_key(self, key, first=False):
+        """Buffer the key of a mapping item, after a separator if not first."""
+        self.add(self._key(key) if first else f'{self._sep}{self._key(key)}')
+
+    def add_item(self, data, first=False, keys=None):
+        """Buffer the encoding of a list item, see :meth:`encode`."""
+        if not first:
+            self.add(self._sep)
+        self.add(self.encode(data, keys))
+
+    def flush(self):
+        """Feed the buffered parts to the hasher."""
+        self.hasher.update(''.join(self._parts).encode('UTF-8'))
+        self._parts.clear()
+        self._size = 0
+
+    @staticmethod
+    def _compat_key(key) -> str:
+        return f'{key!r}: '
+
+    @staticmethod
+    def _json_key(key) -> str:
+        return _encode_json_str(str(key)) + ':'
+
+    def _is_list(self, data) -> bool:
+        return isinstance(data, list) or \
+            (not self.compat and isinstance(data, tuple))
+
+    def write(self, data, depth=2):
+        """Encode data and feed it to the hasher.
+
+        The outer levels up to depth are written item by item, deeper levels
+        are encoded as a whole.
+        """
+        if depth <= 0:
+            self.add(self.encode(data))
+        elif isinstance(data, Mapping):
+            self.add('{')
+            for idx, key in enumerate(sorted(data.keys())):
+                self.add_key(key, not idx)
+                self.write(data[key], depth - 1)
+            self.add('}')
+        elif self._is_list(data):
+            self.add('[')
+            for idx, val in enumerate(data):
+                if idx:
+                    self.add(self._sep)
+                self.write(val, depth - 1)
+            self.add(']')
+        else:
+            self.add(self.encode(data))
+
+    def encode(self, data, keys=None) -> str:
+        """Get the encoding of data as string.
+
+        Args:
+            data: The data to encode.
+            keys: Only encode these keys if data is a mapping, all if None.
+        """
+        if isinstance(data, _SCALARS):
+            return self._leaf(data)
+        if isinstance(data, Mapping):
+            if keys is None:
+                keys = sorted(data.keys())
+            else:
+                keys = sorted(key for key in keys if key in data)
+            key_strs = self._keys
+            leaf = self._leaf
+            parts = []
+            for key in keys:
+                val = data[key]
+                # Only string keys are cached, so 1 and True are kept apart
+                try:
+                    key_str = key_strs[key]
+                except KeyError:
+                    key_str = self._key(key)
+                    if isinstance(key, str):
+                        key_strs[key] = key_str
+                if isinstance(val, _SCALARS):
+                    parts.append(key_str + leaf(val))
+                else:
+                    parts.append(key_str + self.encode(val))
+            return '{' + self._sep.join(parts) + '}'
+        if self._is_list(data):
+            return '[' + self._sep.join([self.encode(val)
+                                         for val in data]) + ']'
+        return self._leaf(data)
+
+    @staticmethod
+    def _compat_leaf(val) -> str:
+        return repr(str(val))
+
+    @staticmethod
+    def _json_leaf(val) -> str:
+        if isinstance(val, str):
+            return _encode_json_str(val)
+        if val is None or isinstance(val, (int, float)):
+            return json.dumps(val)
+        return _encode_json_str(str(val))
+
+
+def _new_hasher(hasher):
+    if isinstance(hasher, str):
+        return hashlib.new(hasher)
+    return hasher()
+
+
+def get_tables_hashes(tables: Mapping, projections: Mapping,
+                      hasher=hashlib.md5, compat=True) -> dict:
+    """Hash a mapping of record sequences once for each projection.
+
+    The hash of a projection is the :func:`get_canonical_hash` of the tables
+    with each record sequence as list and each record only having the keys
+    of the projection. All hashes are calculated in a single pass over the
+    records without copying them, so records that are created on demand only
+    exist one at a time.
+
+    Example:
+        >>> tables = {'map': [{'name': 'a', 'size': 1}]}
+        >>> hashes = get_tables_hashes(tables, {'full': None,
+        ...                                     'size': ('size',)})
+        >>> hashes['size'] == get_canonical_hash({'map': [{'size': 1}]})
+        True
+
+    Args:
+        tables: Names mapped to sequences of record mappings.
+        projections: Names of the hashes mapped to the keys the records are
+                     projected on, all keys if None.
+        hasher: The hashing function to use or the name of a hashlib
+                algorithm.
+        compat: See :func:`get_canonical_hash`.
+
+    Return:
+        dict: The names of the projections mapped to their hashes.
+    """
+    writers = [(CanonicalWriter(_new_hasher(hasher), compat), keys)
+               for keys in projections.values()]
+    for writer, _ in writers:
+        writer.add('{')
+    for idx, name in enumerate(sorted(tables.keys())):
+        for writer, _ in writers:
+            writer.add_key(name, not idx)
+            writer.add('[')
+        for ridx, record in enumerate(tables[name]):
+            for writer, keys in writers:
+                writer.add_item(record, not ridx, keys)
+        for writer, _ in writers:
+            writer.add(']')
+    hashes = {}
+    for name, (writer, _) in zip(projections, writers):
+        writer.add('}')
+        writer.flush()
+        hashes[name] = writer.hasher.hexdigest()
+    return hashes
+
+
+def get_canonical_hash(data, hasher=hashlib.md5, compat=True) -> str:
+    """Calculate a reproducible hash of data without copying it.
+
+    Example:
+        >>> from memory_map_manager.json_sem_hash import get_json_sem_hash
+        >>> data = {'b': [1, 2], 'a': {'c': None}}
+        >>> get_canonical_hash(data) == get_json_sem_hash(data)
+        True
+
+    Args:
+        data: The data to create the hash of.
+        hasher: The hashing function to use or the name of a hashlib
+                algorithm, such as ``'blake2b'``.
+        compat: Hash the same encoding as
+                :func:`memory_map_manager.json_sem_hash.get_json_sem_hash`,
+                where all values are compared as strings, to keep the digests
+                the same. Otherwise a canonical JSON encoding is hashed.
+
+    Return:
+        str: The resulting hash.
+    """
+    hasher = _new_hasher(hasher)
+    writer = CanonicalWriter(hasher, compat)
+    writer.write(data)
+    writer.flush()
+    return hasher.hexdigest()
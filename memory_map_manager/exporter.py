@@ -5,6 +5,7 @@
 # file LICENSE in the top level directory for more details.
 # SPDX-License-Identifier:    MIT
 """Exports generated code to csv, c, and configurations."""
+from collections.abc import Mapping
 import csv
 from io import StringIO
 import json
@@ -14,6 +15,14 @@ from jinja2 import Environment, PackageLoader, select_autoescape
 from yaml import safe_dump
 
 from ._version import __version__ as MMM_VERSION
+from .profiler import profile_phase
+
+
+def _json_default(obj):
+    """Convert the record sequences and record views that json cannot dump."""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return list(obj)
 
 
 class MMMExporter():
@@ -22,10 +31,21 @@ class MMMExporter():
     Generates output strings based on parsed input configurations.
     """
 
+    # pylint: disable-next=too-many-arguments
     def __init__(self, mm_cfg, mm_input_data=None,
-                 hide_version=False, line_width=80):
+                 hide_version=False, line_width=80, *, profiler=None,
+                 map_cache=None):
         """Instantiate the exporter with input data and jinja env."""
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.profiler = profiler
+        """:class:`PhaseProfiler` that measures each generator."""
+        self.map_cache = {} if map_cache is None else map_cache
+        """Rendered output of each map and generator.
+
+        Passed to a new exporter the output of a map is reused if its records
+        are the same objects, as the parser shares the records of unchanged
+        maps with the parser before it.
+        """
         self._cfg = mm_cfg
         self._mm_input_data = mm_input_data
         meta = self._cfg['metadata']
@@ -37,21 +57,40 @@ class MMMExporter():
                        'mmm_version': MMM_VERSION,
                        'hide_version': hide_version}
 
+    def _render_map(self, render, map_name, mdata, *args):
+        """Get the output of render for a map, reused if it did not change.
+
+        The output is reused if the records of the map are the same objects
+        and the arguments are equal to the last time it was rendered.
+        """
+        key = (render.__name__, map_name) + args
+        records = (mdata['records'], mdata['compressed_records'])
+        cached = self.map_cache.get(key)
+        if cached is not None and cached[0][0] is records[0] and \
+                cached[0][1] is records[1] and cached[1] == self._jargs:
+            return cached[2]
+        output = render(map_name, mdata, *args)
+        self.map_cache[key] = (records, self._jargs, output)
+        return output
+
     def _gen_access_map_c(self) -> dict:
         files = {}
         if not self._cfg['metadata']['resolved_permission_users']:
             return files
-        tmpl = self._jenv.get_template("mm_access_map.c.j2")
         for map_name, mdata in self._cfg['maps'].items():
-            mdata = mdata['records']
             fname = f'mm_access_{map_name.lower()}.c'
-            files[fname] = tmpl.render(filename=fname,
-                                       map_name=map_name,
-                                       is_header_file=False,
-                                       records=mdata,
-                                       **self._jargs)
+            files[fname] = self._render_map(self._render_access_map_c,
+                                            map_name, mdata, fname)
         return files
 
+    def _render_access_map_c(self, map_name, mdata, fname) -> str:
+        tmpl = self._jenv.get_template("mm_access_map.c.j2")
+        return tmpl.render(filename=fname,
+                           map_name=map_name,
+                           is_header_file=False,
+                           records=mdata['records'],
+                           **self._jargs)
+
     def _gen_access_map_h(self) -> dict:
         files = {}
         if not self._cfg['metadata']['resolved_permission_users']:
@@ -94,38 +133,38 @@ class MMMExporter():
 
     def _gen_default_map_c(self) -> dict:
         files = {}
-        tmpl = self._jenv.get_template("mm_default_map.c.j2")
         for map_name, mdata in self._cfg['maps'].items():
-            resd = 'resolved_default'
-            usedef = any(rec.get('use_defines') for rec in mdata['records'])
-            if not any(resd in rec for rec in mdata['records']):
-                continue
             fname = f'mm_default_{map_name.lower()}.c'
-            files[fname] = tmpl.render(filename=fname,
-                                       map_name=map_name,
-                                       use_defines=usedef,
-                                       is_header_file=False,
-                                       map_data=mdata,
-                                       **self._jargs)
+            output = self._render_map(self._render_default_map, map_name,
+                                      mdata, fname, False)
+            if output is not None:
+                files[fname] = output
         return files
 
     def _gen_default_map_h(self) -> dict:
         files = {}
-        tmpl = self._jenv.get_template("mm_default_map.h.j2")
         for map_name, mdata in self._cfg['maps'].items():
-            resd = 'resolved_default'
-            usedef = any(rec.get('use_defines') for rec in mdata['records'])
-            if not any(resd in rec for rec in mdata['records']):
-                continue
             fname = f'mm_default_{map_name.lower()}.h'
-            files[fname] = tmpl.render(filename=fname,
-                                       map_name=map_name,
-                                       use_defines=usedef,
-                                       is_header_file=True,
-                                       map_data=mdata,
-                                       **self._jargs)
+            output = self._render_map(self._render_default_map, map_name,
+                                      mdata, fname, True)
+            if output is not None:
+                files[fname] = output
         return files
 
+    def _render_default_map(self, map_name, mdata, fname, is_header_file):
+        resd = 'resolved_default'
+        usedef = any(rec.get('use_defines') for rec in mdata['records'])
+        if not any(resd in rec for rec in mdata['records']):
+            return None
+        ext = 'h' if is_header_file else 'c'
+        tmpl = self._jenv.get_template(f"mm_default_map.{ext}.j2")
+        return tmpl.render(filename=fname,
+                           map_name=map_name,
+                           use_defines=usedef,
+                           is_header_file=is_header_file,
+                           map_data=mdata,
+                           **self._jargs)
+
     def _gen_defs_h(self) -> dict:
         files = {}
         if not self._cfg['defines']:
@@ -238,43 +277,47 @@ class MMMExporter():
         app_name = self._cfg['metadata']['app_name']
         for map_name, mdata in self._cfg['maps'].items():
             fname = f'mm_{app_name}_{map_name}_{version.replace(".", "_")}.csv'
-            output = StringIO()
-            fieldnames = ['name',
-                          'offset',
-                          'total_size',
-                          'type_size',
-                          'type',
-                          'description',
-                          'access',
-                          'array_size',
-                          'bit_offset',
-                          'bits',
-                          'default',
-                          'flag',
-                          'max',
-                          'min'
-                          ]
-            writer = csv.DictWriter(output, extrasaction='ignore',
-                                    fieldnames=fieldnames)
-            writer.writeheader()
-            for record in mdata['records']:
-                record = record.copy()
-                record['offset'] = record.get('map_offset', None)
-                record['total_size'] = record.get('resolved_total_size', None)
-                record['type_size'] = record.get('resolved_type_size', None)
-                record['array_size'] = record.get('resolved_array_size', None)
-                record['bit_offset'] = record.get('resolved_bit_offset', None)
-                record['bits'] = record.get('resolved_bits', None)
-                record['access'] = record.get('resolved_access', None)
-                if record['array_size']:
-                    if record['name'].endswith('[0]'):
-                        record['name'] = record['name'][:-3]
-                        writer.writerow(record)
-                else:
-                    writer.writerow(record)
-            files[fname] = output.getvalue()
+            files[fname] = self._render_map(self._render_legacy_csv,
+                                            map_name, mdata)
         return files
 
+    def _render_legacy_csv(self, _map_name, mdata) -> str:
+        output = StringIO()
+        fieldnames = ['name',
+                      'offset',
+                      'total_size',
+                      'type_size',
+                      'type',
+                      'description',
+                      'access',
+                      'array_size',
+                      'bit_offset',
+                      'bits',
+                      'default',
+                      'flag',
+                      'max',
+                      'min'
+                      ]
+        writer = csv.DictWriter(output, extrasaction='ignore',
+                                fieldnames=fieldnames)
+        writer.writeheader()
+        for record in mdata['records']:
+            record = record.copy()
+            record['offset'] = record.get('map_offset', None)
+            record['total_size'] = record.get('resolved_total_size', None)
+            record['type_size'] = record.get('resolved_type_size', None)
+            record['array_size'] = record.get('resolved_array_size', None)
+            record['bit_offset'] = record.get('resolved_bit_offset', None)
+            record['bits'] = record.get('resolved_bits', None)
+            record['access'] = record.get('resolved_access', None)
+            if record['array_size'] and not record.get('span'):
+                if record['name'].endswith('[0]'):
+                    record['name'] = record['name'][:-3]
+                    writer.writerow(record)
+            else:
+                writer.writerow(record)
+        return output.getvalue()
+
     def _get_unique_fields(self, records, user=None):
         fieldnames = set()
         for rec in records:
@@ -289,16 +332,20 @@ class MMMExporter():
         app_name = meta['app_name']
         for map_name, mdata in self._cfg['maps'].items():
             fname = f'mm_{app_name}_{map_name}_{meta["full_hash"]}.csv'
-            output = StringIO()
-            fieldnames = self._get_unique_fields(mdata['records'])
-            writer = csv.DictWriter(output, extrasaction='ignore',
-                                    fieldnames=fieldnames)
-            writer.writeheader()
-            for record in mdata['records']:
-                writer.writerow(record)
-            files[fname] = output.getvalue()
+            files[fname] = self._render_map(self._render_full_csv,
+                                            map_name, mdata)
         return files
 
+    def _render_full_csv(self, _map_name, mdata) -> str:
+        output = StringIO()
+        fieldnames = self._get_unique_fields(mdata['records'])
+        writer = csv.DictWriter(output, extrasaction='ignore',
+                                fieldnames=fieldnames)
+        writer.writeheader()
+        for record in mdata['records']:
+            writer.writerow(record)
+        return output.getvalue()
+
     def _gen_user_csv(self) -> dict:
         files = {}
         meta = self._cfg['metadata']
@@ -307,22 +354,28 @@ class MMMExporter():
             for map_name, mdata in self._cfg['maps'].items():
                 mhash = meta["full_hash"]
                 fname = f'mm_{app_name}_{map_name}_{user}_{mhash}.csv'
-                output = StringIO()
-                # only look at the read_permission access
-                fieldnames = self._get_unique_fields(mdata['records'],
-                                                     0x10 << idx)
-                writer = csv.DictWriter(output, extrasaction='ignore',
-                                        fieldnames=fieldnames)
-                writer.writeheader()
-                has_data = False
-                for record in mdata['compressed_records']:
-                    if (0x10 << idx) & record['resolved_access']:
-                        has_data = True
-                        writer.writerow(record)
-                if has_data:
-                    files[fname] = output.getvalue()
+                output = self._render_map(self._render_user_csv, map_name,
+                                          mdata, idx)
+                if output is not None:
+                    files[fname] = output
         return files
 
+    def _render_user_csv(self, _map_name, mdata, idx):
+        output = StringIO()
+        # only look at the read_permission access
+        fieldnames = self._get_unique_fields(mdata['records'], 0x10 << idx)
+        writer = csv.DictWriter(output, extrasaction='ignore',
+                                fieldnames=fieldnames)
+        writer.writeheader()
+        has_data = False
+        for record in mdata['compressed_records']:
+            if (0x10 << idx) & record['resolved_access']:
+                has_data = True
+                writer.writerow(record)
+        if has_data:
+            return output.getvalue()
+        return None
+
     def _gen_compressed_csv(self) -> dict:
         files = {}
         version = self._cfg['metadata']['version']
@@ -330,32 +383,35 @@ class MMMExporter():
         for map_name, mdata in self._cfg['maps'].items():
             ver = version.replace(".", "_")
             fname = f'mm_{app_name}_{map_name}_compressed_{ver}.csv'
-            output = StringIO()
-            crs = mdata['compressed_records']
-            all_names = list(sorted(set().union(*(rec.keys() for rec in crs))))
-            fieldnames = ['name',
-                          'compressed_offset',
-                          'resolved_total_size',
-                          'resolved_type_size',
-                          'resolved_type',
-                          'description']
-            for name in all_names:
-                if name not in fieldnames:
-                    fieldnames.append(name)
-
-            writer = csv.DictWriter(output, extrasaction='ignore',
-                                    fieldnames=fieldnames)
-            writer.writeheader()
-            for record in mdata['compressed_records'].copy():
-                writer.writerow(record)
-            files[fname] = output.getvalue()
+            files[fname] = self._render_map(self._render_compressed_csv,
+                                            map_name, mdata)
         return files
 
+    def _render_compressed_csv(self, _map_name, mdata) -> str:
+        output = StringIO()
+        crs = mdata['compressed_records']
+        all_names = list(sorted(set().union(*(rec.keys() for rec in crs))))
+        fieldnames = ['name',
+                      'compressed_offset',
+                      'resolved_total_size',
+                      'resolved_type_size',
+                      'resolved_type',
+                      'description']
+        for name in all_names:
+            if name not in fieldnames:
+                fieldnames.append(name)
+
+        writer = csv.DictWriter(output, extrasaction='ignore',
+                                fieldnames=fieldnames)
+        writer.writeheader()
+        for record in mdata['compressed_records'].copy():
+            writer.writerow(record)
+        return output.getvalue()
+
     def _gen_cfg(self) -> str:
         meta = self._cfg['metadata']
-        return {f'mm_{meta["full_hash"]}_cfg.json': json.dumps(self._cfg,
-                                                               sort_keys=True,
-                                                               indent=2)}
+        return {f'mm_{meta["full_hash"]}_cfg.json': json.dumps(
+            self._cfg, sort_keys=True, indent=2, default=_json_default)}
 
     def _gen_input_cfg(self) -> str:
         return {'mm_input_cfg.yaml': safe_dump(self._mm_input_data,
@@ -368,22 +424,20 @@ class MMMExporter():
             dict[str]: A dictionary where the keys are the filenames and the
                        values are the file contents.
         """
-        files = {}
-        files.update(self._gen_access_h())
-        files.update(self._gen_access_map_c())
-        files.update(self._gen_access_map_h())
-        files.update(self._gen_access_types_h())
-        files.update(self._gen_bitfields_h())
-        files.update(self._gen_default_map_c())
-        files.update(self._gen_default_map_h())
-        files.update(self._gen_defs_h())
-        files.update(self._gen_typedef_h())
-        files.update(self._gen_typedef_type_h())
-        files.update(self._gen_typedef_map_h())
-        files.update(self._gen_cc_h())
-        files.update(self._gen_meta_h())
-        files.update(self._gen_enums_h())
-        return files
+        return self._run_gens(self._gen_access_h,
+                              self._gen_access_map_c,
+                              self._gen_access_map_h,
+                              self._gen_access_types_h,
+                              self._gen_bitfields_h,
+                              self._gen_default_map_c,
+                              self._gen_default_map_h,
+                              self._gen_defs_h,
+                              self._gen_typedef_h,
+                              self._gen_typedef_type_h,
+                              self._gen_typedef_map_h,
+                              self._gen_cc_h,
+                              self._gen_meta_h,
+                              self._gen_enums_h)
 
     def gen_csv_files(self) -> dict:
         """Create csv file strings based on configuration.
@@ -392,12 +446,10 @@ class MMMExporter():
             dict[str]: A dictionary where the keys are the filenames and the
                        values are the file contents.
         """
-        files = {}
-        files.update(self._gen_full_csv())
-        files.update(self._gen_legacy_csv())
-        files.update(self._gen_compressed_csv())
-        files.update(self._gen_user_csv())
-        return files
+        return self._run_gens(self._gen_full_csv,
+                              self._gen_legacy_csv,
+                              self._gen_compressed_csv,
+                              self._gen_user_csv)
 
     def gen_cfg_files(self) -> dict:
         """Create configuration file strings based on configuration.
@@ -406,8 +458,14 @@ class MMMExporter():
             dict[str]: A dictionary where the keys are the filenames and the
                        values are the file contents.
         """
-        files = {}
-        files.update(self._gen_cfg())
         if self._mm_input_data:
-            files.update(self._gen_input_cfg())
+            return self._run_gens(self._gen_cfg, self._gen_input_cfg)
+        return self._run_gens(self._gen_cfg)
+
+    def _run_gens(self, *gens) -> dict:
+        """Run generators in order, each one is a phase of the profiler."""
+        files = {}
+        for gen in gens:
+            with profile_phase(self.profiler, gen.__name__):
+                files.update(gen())
         return files
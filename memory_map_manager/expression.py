@@ -0,0 +1,124 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Compiled and memoized evaluation of configuration expressions.
+
+Values such as ``array_size``, ``bits`` or ``scaling_factor`` can be numbers
+or expressions using defines. Expressions are restricted to arithmetic,
+bitwise, comparison and boolean operations, constants, names and a few
+builtin functions.
+"""
+import ast
+from functools import lru_cache
+import sys
+
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd,
+    ast.UAdd, ast.USub, ast.Not, ast.Invert, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE
+)
+if sys.version_info < (3, 8):  # pragma: no cover
+    # pylint: disable-next=no-member
+    _ALLOWED_NODES += (ast.Num, ast.Str, ast.NameConstant)
+
+FUNCTIONS = {'abs': abs, 'float': float, 'int': int,
+             'max': max, 'min': min, 'round': round}
+"""Functions that can be called in expressions."""
+
+_GLOBALS = {'__builtins__': {}, **FUNCTIONS}
+
+
+@lru_cache(maxsize=None)
+def compile_expr(expr: str) -> tuple:
+    """Parse, check and compile an expression.
+
+    Example:
+        >>> code, names = compile_expr('max(a, 2) * b')
+        >>> sorted(names)
+        ['a', 'b']
+
+    Args:
+        expr: The expression to compile.
+
+    Return:
+        tuple: The code object and the frozenset of names the expression
+               refers to, excluding the names of called functions.
+
+    Raises:
+        ValueError: The expression uses something that is not allowed.
+    """
+    tree = ast.parse(expr.strip(), mode='eval')
+    names = set()
+    # Only the called names are functions, a define may be named like one
+    calls = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f'{type(node).__name__} is not allowed in '
+                             f'expression {expr!r}')
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or \
+                    node.func.id not in FUNCTIONS:
+                raise ValueError(f'Only {sorted(FUNCTIONS)} can be called in '
+                                 f'expression {expr!r}')
+            calls.add(id(node.func))
+        elif isinstance(node, ast.Name) and id(node) not in calls:
+            names.add(node.id)
+    return compile(tree, '<expression>', 'eval'), frozenset(names)
+
+
+class ExpressionEngine():
+    """Evaluates expressions, compiling and evaluating each one only once.
+
+    Numbers are returned as is without a string round trip. Results of
+    strings are memoized until :meth:`clear` is called, which must be done if
+    the names an expression may use change.
+
+    Example:
+        >>> engine = ExpressionEngine()
+        >>> engine.evaluate('a + 1', {'a': 2})
+        3
+        >>> engine.evaluate(4, {})
+        4
+    """
+
+    def __init__(self):
+        """Instantiate the engine with an empty memo."""
+        self._results = {}
+
+    def clear(self):
+        """Forget all memoized results."""
+        self._results.clear()
+
+    @staticmethod
+    def get_names(expr: str) -> frozenset:
+        """Get the names an expression refers to."""
+        return compile_expr(expr)[1]
+
+    def evaluate(self, expr, names: dict):
+        """Evaluate an expression with the given names.
+
+        Args:
+            expr: The expression string or a number.
+            names: The values of names that can be used, such as defines.
+
+        Return:
+            The resulting value.
+        """
+        if isinstance(expr, (int, float)) or expr is None:
+            return expr
+        expr = str(expr)
+        try:
+            return self._results[expr]
+        except KeyError:
+            pass
+        code, _ = compile_expr(expr)
+        val = eval(code, _GLOBALS, names)
+        self._results[expr] = val
+        return val
@@ -0,0 +1,97 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Persistent cache of parsed and validated input files."""
+from contextlib import contextmanager
+from hashlib import sha256
+import logging
+import os
+import pickle
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from ._version import __version__ as MMM_VERSION
+
+
+class FileCache():
+    """On-disk cache for data parsed from input files.
+
+    Each file gets its own pickled entry keyed by the real path, mtime, size
+    and content hash of the file. An entry is only used if all of them still
+    match. Access is guarded with a lock file so multiple processes can share
+    the same cache directory.
+    """
+
+    _LOCK_NAME = '.lock'
+
+    def __init__(self, cache_dir, namespace=MMM_VERSION):
+        """Instantiate the cache, creating the directory if needed."""
+        self.logger = logging.getLogger(self.__class__.__name__)
+        """Logger the this class."""
+
+        self.cache_dir = cache_dir
+        """Directory to store the cache entries."""
+
+        self.namespace = namespace
+        """Separates entries of incompatible versions in the same directory."""
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, fpath):
+        name = f'{self.namespace}:{fpath}'.encode('utf-8')
+        return os.path.join(self.cache_dir,
+                            f'{sha256(name).hexdigest()}.pickle')
+
+    @contextmanager
+    def _lock(self, shared):
+        lock_path = os.path.join(self.cache_dir, self._LOCK_NAME)
+        with open(lock_path, 'a', encoding="utf-8") as lock_f:
+            if fcntl is not None:
+                fcntl.flock(lock_f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_key(fpath, content: bytes) -> tuple:
+        """Get the key of a file from its stats and content."""
+        fpath = os.path.realpath(fpath)
+        fstat = os.stat(fpath)
+        return (fpath, fstat.st_mtime_ns, fstat.st_size,
+                sha256(content).hexdigest())
+
+    def get(self, key: tuple):
+        """Get the cached data of a file key, None if there is no match."""
+        entry_path = self._entry_path(key[0])
+        try:
+            with self._lock(shared=True):
+                with open(entry_path, 'rb') as entry_f:
+                    entry = pickle.load(entry_f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as exc:
+            self.logger.warning("Ignoring cache entry of %r: %s", key[0], exc)
+            return None
+        if entry['key'] != key:
+            return None
+        self.logger.debug("Using cached data of %r", key[0])
+        return entry['data']
+
+    def set(self, key: tuple, data):
+        """Store the data of a file key."""
+        entry_path = self._entry_path(key[0])
+        with self._lock(shared=False):
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir,
+                                             delete=False) as tmp_f:
+                pickle.dump({'key': key, 'data': data}, tmp_f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_f.name, entry_path)
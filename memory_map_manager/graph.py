@@ -0,0 +1,171 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Dependency graph helpers for resolving the configuration."""
+import heapq
+
+
+def topological_order(deps: dict) -> list:
+    """Sort nodes so that every node comes after its dependencies.
+
+    This uses Kahn's algorithm so it is linear in the amount of nodes and
+    dependencies. Nodes that are ready at the same time are taken in sorted
+    order to keep the result deterministic.
+
+    Example:
+        >>> topological_order({'c': ['a', 'b'], 'b': ['a'], 'a': []})
+        ['a', 'b', 'c']
+
+    Args:
+        deps: The nodes mapped to the nodes they depend on, dependencies that
+              are not nodes are ignored.
+
+    Return:
+        list: The nodes in dependency order.
+
+    Raises:
+        RecursionError: There is a circular dependency, the message contains
+                        the cycle.
+    """
+    dependents = {node: [] for node in deps}
+    in_degree = {}
+    for node, node_deps in deps.items():
+        node_deps = {dep for dep in node_deps if dep in dependents}
+        in_degree[node] = len(node_deps)
+        for dep in node_deps:
+            dependents[dep].append(node)
+    ready = [node for node, degree in in_degree.items() if degree == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        node = heapq.heappop(ready)
+        order.append(node)
+        for dependent in dependents[node]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                heapq.heappush(ready, dependent)
+    if len(order) != len(deps):
+        remaining = set(deps) - set(order)
+        cycle = ' -> '.join(find_cycle(deps, remaining))
+        raise RecursionError(f'Circular dependency {cycle}')
+    return order
+
+
+def find_cycle(deps: dict, nodes=None) -> list:
+    """Find a dependency cycle.
+
+    Example:
+        >>> find_cycle({'a': ['b'], 'b': ['c'], 'c': ['b']})
+        ['b', 'c', 'b']
+
+    Args:
+        deps: The nodes mapped to the nodes they depend on.
+        nodes: Only look for cycles within these nodes, defaults to all.
+
+    Return:
+        list: The nodes of the cycle where the first and last are the same,
+              empty if there is no cycle.
+    """
+    if nodes is None:
+        nodes = set(deps)
+
+    def _children(node):
+        return iter(sorted(dep for dep in deps[node] if dep in nodes))
+
+    visited = set()
+    for start in sorted(nodes):
+        if start in visited:
+            continue
+        path = [start]
+        on_path = {start}
+        stack = [_children(start)]
+        visited.add(start)
+        while stack:
+            for child in stack[-1]:
+                if child in on_path:
+                    return path[path.index(child):] + [child]
+                if child not in visited:
+                    visited.add(child)
+                    on_path.add(child)
+                    path.append(child)
+                    stack.append(_children(child))
+                    break
+            else:
+                on_path.discard(path.pop())
+                stack.pop()
+    return []
+
+
+class DependencyGraph():
+    """Graph of nodes and the nodes they depend on.
+
+    Example:
+        >>> graph = DependencyGraph()
+        >>> graph.add('td_2', ['td_1', 'uint8_t'])
+        >>> graph.add('td_3', ['td_2'])
+        >>> graph.add('td_1')
+        >>> sorted(graph.get_dependents('td_1'))
+        ['td_2', 'td_3']
+        >>> graph.topological_order()
+        ['td_1', 'td_2', 'td_3']
+    """
+
+    def __init__(self):
+        """Instantiate an empty graph."""
+        self._deps = {}
+        self._dependents = {}
+
+    def __contains__(self, node):
+        """Check if a node is in the graph."""
+        return node in self._deps
+
+    def __iter__(self):
+        """Iterate over the nodes in the order they were added."""
+        return iter(self._deps)
+
+    def add(self, node, deps=()):
+        """Add a node with the nodes it depends on.
+
+        Dependencies do not need to be added as nodes, for example primary
+        types that are always known.
+        """
+        for dep in self._deps.get(node, ()):
+            self._dependents[dep].discard(node)
+        self._deps[node] = set(deps)
+        for dep in self._deps[node]:
+            self._dependents.setdefault(dep, set()).add(node)
+
+    def get_deps(self, node) -> set:
+        """Get the direct dependencies of a node."""
+        return set(self._deps[node])
+
+    def get_dependents(self, node, recursive=True) -> set:
+        """Get the nodes that depend on a node.
+
+        Args:
+            node: The node that others depend on.
+            recursive: Also include nodes that depend on it indirectly.
+
+        Return:
+            set: The dependent nodes.
+        """
+        dependents = set(self._dependents.get(node, ()))
+        if not recursive:
+            return dependents
+        todo = list(dependents)
+        while todo:
+            for dependent in self._dependents.get(todo.pop(), ()):
+                if dependent not in dependents:
+                    dependents.add(dependent)
+                    todo.append(dependent)
+        return dependents
+
+    def topological_order(self) -> list:
+        """Get the nodes sorted so each comes after its dependencies.
+
+        See :func:`topological_order`.
+        """
+        return topological_order(self._deps)
@@ -5,12 +5,28 @@
 # file LICENSE in the top level directory for more details.
 # SPDX-License-Identifier:    MIT
 """Imports configurations and map info."""
-from json import load
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import sha256
+from io import BytesIO
+from json import load, loads
 import logging
-from os import path
+from os import path, stat
 
-from jsonschema import validate
-from yaml import safe_load
+from jsonschema.exceptions import ValidationError, best_match
+from jsonschema.validators import validator_for
+from yaml import load as yaml_load
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+from .file_cache import FileCache
+from .profiler import profile_phase
 
 
 _PATH_TO_IMPORT_SCHEMA = path.join(path.dirname(path.realpath(__file__)),
@@ -18,11 +34,121 @@ _PATH_TO_IMPORT_SCHEMA = path.join(path.dirname(path.realpath(__file__)),
 _PATH_TO_INPUT_CONFIG_SCHEMA = path.join(path.dirname(path.realpath(__file__)),
                                          "data/mm_map_cfg.json")
 
+_VALIDATORS = {}
+"""Compiled schema validators, keyed by the schema path."""
+
+_VALIDATED = set()
+"""Schema path and content hash pairs that have already passed validation."""
+
+
+def _get_validator(schema_path):
+    """Get the validator for a schema, loading and checking it only once."""
+    validator = _VALIDATORS.get(schema_path)
+    if validator is None:
+        with open(schema_path, encoding="utf-8") as schema_f:
+            schema = load(schema_f)
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        _VALIDATORS[schema_path] = validator
+    return validator
+
+
+def _validate(data, schema_path, content: bytes):
+    """Validate data parsed from content against a schema.
+
+    This behaves like ``jsonschema.validate`` but reuses the compiled
+    validator. The hash of valid content is remembered so unchanged files are
+    not validated again.
+    """
+    key = (schema_path, sha256(content).hexdigest())
+    if key in _VALIDATED:
+        return
+    error = best_match(_get_validator(schema_path).iter_errors(data))
+    if error is not None:
+        raise error
+    _VALIDATED.add(key)
+
+
+def _parse_content(fname, content: bytes):
+    """Parse the content of a file based on the file extension.
+
+    Files ending with ``.json`` or ``.msgpack`` skip the YAML parser, anything
+    else is parsed as YAML using libyaml if available.
+    """
+    ext = path.splitext(str(fname))[1].lower()
+    if ext == '.json':
+        return loads(content)
+    if ext == '.msgpack':
+        if msgpack is None:
+            raise ImportError(f'msgpack is required to import {fname}')
+        return msgpack.unpackb(content, raw=False)
+    # Errors name the file the stream was read from instead of "<byte string>"
+    stream = BytesIO(content)
+    stream.name = str(fname)
+    return yaml_load(stream, Loader=SafeLoader)
+
+
+def _load_map_file(map_file, cache_dir=None, profiler=None):
+    """Load and validate a single map file.
+
+    If a cache directory is given then the validated data is taken from or
+    stored in the cache. This is a module level function so it can be run in
+    a process pool, where the validation is not profiled.
+    """
+    with open(map_file, 'rb') as fhandle:
+        content = fhandle.read()
+    cache = None
+    if cache_dir:
+        cache = FileCache(cache_dir)
+        key = cache.get_key(map_file, content)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    data = _parse_content(map_file, content)
+    with profile_phase(profiler, 'validation'):
+        _validate(data, _PATH_TO_INPUT_CONFIG_SCHEMA, content)
+    if cache is not None:
+        cache.set(key, data)
+    return data
+
+
+def _get_stamp(fpath) -> tuple:
+    """Get the modification time and size of a file to detect changes."""
+    fstat = stat(fpath)
+    return (fstat.st_mtime_ns, fstat.st_size)
+
+
+def _add_note(exc: BaseException, note: str):
+    """Add a note to an exception, shown in its traceback from Python 3.11.
+
+    Before Python 3.11 the note is only added to ``__notes__``.
+    """
+    if hasattr(exc, 'add_note'):
+        exc.add_note(note)
+    else:
+        exc.__notes__ = getattr(exc, '__notes__', []) + [note]
+
+
+def _load_map_file_worker(map_file, cache_dir=None):
+    """Load a map file in a worker process.
+
+    Validation errors hold a reference to the validator which cannot be
+    pickled back to the main process so only the error details are sent.
+    """
+    try:
+        return _load_map_file(map_file, cache_dir)
+    except ValidationError as exc:
+        raise ValidationError(exc.message, validator=exc.validator,
+                              path=exc.path, schema_path=exc.schema_path,
+                              validator_value=exc.validator_value,
+                              instance=exc.instance) from None
+
 
 class MMMImporter():
     """Memory map manager importer."""
 
-    def __init__(self, cfg_file=None):
+    def __init__(self, cfg_file=None, jobs=None, profiler=None):
         """Instantiate the importer with a configuration file."""
         self.logger = logging.getLogger(self.__class__.__name__)
         """Logger the this class."""
@@ -45,13 +171,29 @@ class MMMImporter():
         self.overwrite_conflicts = False
         """Overwrite conflicts by default."""
 
+        self.jobs = jobs
+        """Amount of processes to load map files with, serial if not set."""
+
+        self.cache_dir = None
+        """Directory to cache the validated map file data, off if not set."""
+
+        self.profiler = profiler
+        """:class:`PhaseProfiler` that measures the import and validation."""
+
         self._mm_files = []
         self._base_dir = None
+        self._loaded = {}
+        """Stamp and data of loaded map files so unchanged ones are reused."""
 
         if cfg_file:
             self.import_cfg_file(cfg_file)
             self.import_map_data()
 
+    @property
+    def map_files(self) -> list:
+        """Paths of the map files from the configuration file."""
+        return list(self._mm_files)
+
     def _get_fpath(self, fpath):
         if fpath is None:
             return None
@@ -67,12 +209,12 @@ class MMMImporter():
         This file contains all the parameters such as other files and export
         directories when running the configuration generation.
         """
-        with open(cfg_file, 'r', encoding="utf-8") as fhandle:
-            cfg_data = fhandle.read()
-        cfg = safe_load(cfg_data)
-        with open(_PATH_TO_IMPORT_SCHEMA, encoding="utf-8") as schema_f:
-            schema = load(schema_f)
-        validate(cfg, schema)
+        with profile_phase(self.profiler, 'import'):
+            with open(cfg_file, 'rb') as fhandle:
+                cfg_data = fhandle.read()
+            cfg = _parse_content(cfg_file, cfg_data)
+            with profile_phase(self.profiler, 'validation'):
+                _validate(cfg, _PATH_TO_IMPORT_SCHEMA, cfg_data)
 
         abs_main = path.dirname(path.realpath(cfg_file))
         cfg_wd = cfg.get('base_dir', abs_main)
@@ -80,12 +222,14 @@ class MMMImporter():
             cfg_wd = path.join(abs_main, cfg_wd)
         self._base_dir = cfg_wd
 
+        self._mm_files = []
         for fname in cfg['files']:
             self._mm_files.append(self._get_fpath(fname))
 
         self.c_dir = self._get_fpath(cfg.get('c_dir', None))
         self.csv_dir = self._get_fpath(cfg.get('csv_dir', None))
         self.cfg_dir = self._get_fpath(cfg.get('cfg_dir', None))
+        self.cache_dir = self._get_fpath(cfg.get('cache_dir', None))
         self.prompt_conflicts = cfg.get('prompt_conflicts', False)
         self.overwrite_conflicts = cfg.get('overwrite_conflicts', False)
 
@@ -98,14 +242,12 @@ class MMMImporter():
             map_files = self._mm_files
         elif not isinstance(map_files, list):
             map_files = [map_files]
+        with profile_phase(self.profiler, 'import'):
+            self.mm_data = self._merge_map_files(map_files)
+
+    def _merge_map_files(self, map_files) -> dict:
         mm_data = {}
-        for map_file in map_files:
-            with open(map_file, 'r', encoding="utf-8") as yaml_files:
-                data = safe_load(yaml_files)
-            with open(_PATH_TO_INPUT_CONFIG_SCHEMA,
-                      encoding="utf-8") as schema_f:
-                schema = load(schema_f)
-            validate(data, schema)
+        for data in self._load_map_files(map_files):
             for key, val in data.items():
                 mm_data.setdefault(key, []).append(val)
 
@@ -133,7 +275,49 @@ class MMMImporter():
         # metadata:
         #   app_name: from_file_1 # Depending on settings or user selection
         # ...
-        self.mm_data = mm_data
+        return mm_data
+
+    def _load_map_files(self, map_files) -> list:
+        """Load and validate map files that changed since the last import.
+
+        Files with the same modification time and size as when they were last
+        loaded reuse the previous data. The results are always in the order of
+        the map files so merging is the same as loading serially.
+        """
+        # The stamp is taken before reading so a file changing while it is
+        # loaded will be detected as changed on the next import.
+        stamps = {str(fname): _get_stamp(fname) for fname in map_files}
+        changed = [fname for fname in map_files
+                   if self._loaded.get(str(fname), (None,))[0] !=
+                   stamps[str(fname)]]
+        for fname, data in zip(changed, self._load_changed_files(changed)):
+            self._loaded[str(fname)] = (stamps[str(fname)], data)
+        return [self._loaded[str(fname)][1] for fname in map_files]
+
+    def _load_changed_files(self, map_files) -> list:
+        """Load and validate map files, in parallel if jobs are set."""
+        if not self.jobs or self.jobs < 2 or len(map_files) < 2:
+            loaders = [partial(_load_map_file, fname, self.cache_dir,
+                               self.profiler)
+                       for fname in map_files]
+            return self._collect_map_files(map_files, loaders)
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(_load_map_file_worker, fname,
+                                       self.cache_dir)
+                       for fname in map_files]
+            return self._collect_map_files(map_files,
+                                           [fut.result for fut in futures])
+
+    def _collect_map_files(self, map_files, loaders) -> list:
+        all_data = []
+        for map_file, loader in zip(map_files, loaders):
+            try:
+                all_data.append(loader())
+            except Exception as exc:
+                self.logger.error("Failed to import %r", str(map_file))
+                _add_note(exc, f'Failed to import {str(map_file)!r}')
+                raise
+        return all_data
 
     def _check_dict_conflict(self, known: dict, new: dict, key):
         """Try to change and resolve any conflicts of keys.
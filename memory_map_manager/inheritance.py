@@ -0,0 +1,95 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Properties that records inherit from the types they are nested in."""
+
+
+class InheritanceContext():
+    """Stack of inherited properties with a merged layer per nesting level.
+
+    Each level holds the properties of all levels above it merged with the
+    inheritable properties of its own source, so a record only needs to be
+    merged with the top level. Levels and inherited records are memoized by
+    the identity of their sources, so all instances of a nested type share
+    the same dicts. The sources must not change while the context is used,
+    call :meth:`reset` after they changed.
+
+    Example:
+        >>> ctx = InheritanceContext(['name'])
+        >>> ctx.reset({'name': 'type_1', 'read_permission': 1})
+        >>> ctx.push({'name': 'rec_1', 'description': 'inherited'})
+        >>> ctx.inherit({'name': 'rec_2'})
+        {'read_permission': 1, 'description': 'inherited', 'name': 'rec_2'}
+        >>> ctx.pop()
+        >>> ctx.inherit({'name': 'rec_2'})
+        {'read_permission': 1, 'name': 'rec_2'}
+    """
+
+    def __init__(self, reserved_keys):
+        """Instantiate with the keys that are never inherited."""
+        self.reserved_keys = frozenset(reserved_keys)
+        """Keys that are not inherited."""
+
+        self._layers = []
+        self._props = {}
+        self._merged = {}
+        self._inherited = {}
+
+    def reset(self, source: dict):
+        """Start over with a single level and forget memoized results."""
+        self._props.clear()
+        self._merged.clear()
+        self._inherited.clear()
+        self._layers = [self.get_props(source)]
+
+    def get_props(self, source: dict) -> dict:
+        """Get the properties of a source that can be inherited."""
+        try:
+            return self._props[id(source)][1]
+        except KeyError:
+            pass
+        props = {key: val for key, val in source.items()
+                 if key not in self.reserved_keys}
+        # Keep the source so its id cannot be reused while memoized
+        self._props[id(source)] = (source, props)
+        return props
+
+    @property
+    def top(self) -> dict:
+        """The merged properties of the innermost level."""
+        return self._layers[-1]
+
+    def push(self, source: dict):
+        """Add a nesting level with the inheritable properties of a source."""
+        top = self._layers[-1]
+        key = (id(top), id(source))
+        try:
+            merged = self._merged[key][2]
+        except KeyError:
+            props = self.get_props(source)
+            merged = {**top, **props} if props else top
+            self._merged[key] = (top, source, merged)
+        self._layers.append(merged)
+
+    def pop(self):
+        """Remove the innermost nesting level."""
+        del self._layers[-1]
+
+    def inherit(self, record: dict) -> dict:
+        """Get a record with the properties of all levels applied.
+
+        The same dict is returned for the same record at the same level so
+        only properties that are equal for all instances may be added to it.
+        """
+        top = self._layers[-1]
+        key = (id(top), id(record))
+        try:
+            return self._inherited[key][2]
+        except KeyError:
+            pass
+        inherited = {**top, **record}
+        self._inherited[key] = (top, record, inherited)
+        return inherited
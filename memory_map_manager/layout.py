@@ -0,0 +1,165 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Layout of the members of typedef structs."""
+
+
+def get_padding_element(offset: int, size: int, name=None) -> dict:
+    """Get a reserved element that fills padding bytes.
+
+    Example:
+        >>> get_padding_element(3, 1, 0)['name']
+        'padding_0'
+
+    Args:
+        offset: The offset of the padding in the struct.
+        size: The amount of padding bytes.
+        name: Index of the padding in the struct, only ``padding`` if None.
+
+    Return:
+        dict: The resolved padding element.
+    """
+    if name is not None:
+        name = f'padding_{name}'
+    else:
+        name = 'padding'
+    return {
+        'name': name,
+        'description': 'padding bytes',
+        'reserved': True,
+        'resolved_array_size': size,
+        'resolved_offset': offset,
+        'resolved_type_size': 1,
+        'resolved_type': 'uint8_t',
+        'resolved_total_size': size
+    }
+
+
+def get_alignment(element: dict, align: int) -> int:
+    """Get the natural alignment of a member, its type size up to align."""
+    return min(element['resolved_type_size'], align)
+
+
+class StructLayout():
+    """Places the members of a struct and the padding between them.
+
+    Members are added in order and padding is appended as it is needed, so
+    the layout is computed in a single pass.
+
+    By default padding is added after each member that does not end on the
+    align border. With natural alignment padding is only added before a
+    member that does not start on its own alignment, see
+    :func:`get_alignment`, and at the end of the struct, so small members
+    can share an aligned word.
+
+    Example:
+        >>> layout = StructLayout(align=4)
+        >>> layout.add({'name': 'a', 'resolved_total_size': 1})
+        >>> layout.add({'name': 'b', 'resolved_total_size': 4})
+        >>> layout.finish()
+        8
+        >>> [(ele['name'], ele['resolved_offset']) for ele in layout.elements]
+        [('a', 0), ('padding_0', 1), ('b', 4)]
+        >>> layout.padding
+        3
+    """
+
+    def __init__(self, align=None, struct_align=None, total_size=None,
+                 natural=False):
+        """Instantiate an empty layout.
+
+        Args:
+            align: Byte border each member ends on, no padding if None.
+            struct_align: Byte border the struct ends on, no padding if None.
+                          A struct already ending on it grows by
+                          struct_align.
+            total_size: Fixed size of the struct, overrides struct_align.
+            natural: Align members to their natural alignment instead.
+        """
+        self.align = align
+        """Byte border each member ends on."""
+
+        self.natural = natural
+        """Align members to their natural alignment, up to align."""
+
+        self.struct_align = struct_align
+        """Byte border the struct ends on."""
+
+        self.total_size = total_size
+        """Size of the struct, set by :meth:`finish` if not fixed."""
+
+        self.elements = []
+        """The members and padding elements in order."""
+
+        self.offset = 0
+        """Offset after the last element."""
+
+        self.padding = 0
+        """Amount of padding bytes."""
+
+        self._align_pads = 0
+
+    def _pad(self, size: int, name=None):
+        self.elements.append(get_padding_element(self.offset, size, name))
+        self.offset += size
+        self.padding += size
+
+    def _pad_to(self, border: int):
+        if self.offset % border:
+            self._pad(border - self.offset % border, self._align_pads)
+            self._align_pads += 1
+
+    def add(self, element: dict):
+        """Place a member with a ``resolved_total_size`` at the end."""
+        if self.align and self.natural:
+            self._pad_to(get_alignment(element, self.align))
+        element['resolved_offset'] = self.offset
+        self.elements.append(element)
+        self.offset += element['resolved_total_size']
+        if self.align and not self.natural:
+            self._pad_to(self.align)
+
+    @staticmethod
+    def reorder(elements: list, align: int) -> list:
+        """Sort members to minimize the padding of natural alignment.
+
+        Members are sorted by descending alignment, members with the same
+        alignment keep their order.
+
+        Example:
+            >>> elements = [{'name': 'a', 'resolved_type_size': 1},
+            ...             {'name': 'b', 'resolved_type_size': 4},
+            ...             {'name': 'c', 'resolved_type_size': 2}]
+            >>> [ele['name'] for ele in StructLayout.reorder(elements, 4)]
+            ['b', 'c', 'a']
+        """
+        return sorted(elements, key=lambda ele: -get_alignment(ele, align))
+
+    def finish(self) -> int:
+        """Fill the struct to its total size and get the total size.
+
+        Raises:
+            ValueError: The members exceed the fixed total size.
+        """
+        if self.align and self.natural:
+            self._pad_to(self.align)
+        if self.total_size is not None:
+            if self.offset > self.total_size:
+                raise ValueError(f'total size limit ({self.total_size}) '
+                                 f'exceeds calculated size {self.offset}')
+            if self.offset < self.total_size:
+                self._pad(self.total_size - self.offset)
+        elif self.struct_align:
+            pad_size = self.struct_align - self.offset % self.struct_align
+            if pad_size != self.struct_align:
+                self._pad(pad_size)
+            else:
+                # A struct that ends on the border always got another
+                # struct_align bytes, without a padding element for them
+                self.total_size = self.offset + pad_size
+                return self.total_size
+        self.total_size = self.offset
+        return self.total_size
@@ -0,0 +1,495 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Resolution of the records of a generated map."""
+from concurrent.futures import ProcessPoolExecutor
+
+from memory_map_manager.inheritance import InheritanceContext
+from memory_map_manager.records import ColumnarRecords, LazyRecords, \
+    Record, RecordName
+
+
+def get_compressed_offset(base: int, infos: list) -> str:
+    """Get the offset string of a compressed record.
+
+    The offset of an element is ``base`` plus the sum of each index times the
+    ``stride`` of its array.
+
+    Example:
+        >>> get_compressed_offset(12, [{'idx_name': 'n', 'size': 4,
+        ...                             'stride': 8},
+        ...                            {'idx_name': 'm', 'size': 2,
+        ...                             'stride': 2}])
+        '12+8*n+2*m'
+
+    Args:
+        base: The map offset of the first element.
+        infos: The ``compressed_info`` of the record, from the outermost
+               array.
+
+    Return:
+        str: The offset as ``compressed_offset``.
+    """
+    return f'{base}' + ''.join(f'+{info["stride"]}*{info["idx_name"]}'
+                               for info in infos)
+
+
+def get_element_offsets(base: int, infos: list) -> list:
+    """Get the map offsets of all elements of a compressed record.
+
+    Example:
+        >>> get_element_offsets(12, [{'size': 2, 'stride': 8},
+        ...                          {'size': 2, 'stride': 2}])
+        [12, 14, 20, 22]
+
+    Args:
+        base: The map offset of the first element.
+        infos: The ``compressed_info`` of the record, from the outermost
+               array.
+
+    Return:
+        list: The offsets in the order of the expanded records.
+    """
+    offsets = [base]
+    for info in infos:
+        offsets = [offset + idx * info['stride'] for offset in offsets
+                   for idx in range(info['size'])]
+    return offsets
+
+
+def _resolve_worker(resolver, type_name: str) -> tuple:
+    """Resolve a map in a worker process starting with array uid 1.
+
+    Only the results are sent back to the main process.
+    """
+    uids = resolver.resolve(type_name) - 1
+    return resolver.records, resolver.compressed_records, uids
+
+
+def resolve_parallel(resolvers: dict, maps: dict, jobs: int) -> dict:
+    """Resolve each map in a worker process.
+
+    The array uids of the results start with 1, the caller shifts them with
+    :meth:`MapResolver.shift_uids` when merging the maps in order, so they
+    are the same as when resolving serially.
+
+    Args:
+        resolvers: The :class:`MapResolver` of each map to resolve.
+        maps: The generated maps with the name of their typedef.
+        jobs: Amount of worker processes.
+
+    Return:
+        dict: The amount of array uids of each map.
+    """
+    uids = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {mname: executor.submit(_resolve_worker, resolver,
+                                          maps[mname]['type'])
+                   for mname, resolver in resolvers.items()}
+        for mname, future in futures.items():
+            resolver = resolvers[mname]
+            (resolver.records, resolver.compressed_records,
+             uids[mname]) = future.result()
+    return uids
+
+
+class MapResolver():
+    """Resolves the records of one map from its resolved types.
+
+    All state of walking the typedefs is kept here, so the parser only
+    collects the results of each map.
+    """
+
+    def __init__(self, parser, name: str, bitfields: dict,
+                 permission_users: dict, expand_spans=False):
+        """Instantiate the resolver of a map with the resolved types.
+
+        Args:
+            parser: The :class:`MMMConfigParser` with the resolved typedefs
+                    and the record options.
+            name: Name of the map.
+            bitfields: The resolved bitfields.
+            permission_users: The permission users mapped to their bits.
+            expand_spans: Resolve reserved arrays like other arrays instead
+                          of as a span.
+        """
+        self.name = name
+        """Name of the map."""
+
+        self.expand_arrays = parser.expand_arrays
+        self.compact_records = parser.compact_records
+        self.expand_spans = expand_spans
+
+        self.records = self._new_records(parser)
+        """The resolved records, see :attr:`MMMConfigParser.maps`."""
+
+        self.compressed_records = []
+        """Copies of the records with the arrays compressed."""
+
+        self._typedefs = parser.typedefs
+        self._bfs = bitfields
+        self._primaries = parser.PRIMARIES
+        self._permission_users = permission_users
+        self._inherit = InheritanceContext(parser.RESERVED_KEYS)
+        """Properties inherited from the types records are nested in."""
+
+        self._record_prefix = None
+        self._compress_array = []
+        self._compress_uid = 0
+        self._map_offset = 0
+        self._blocks = {}
+        """Resolved records of typedefs by inheritance level, see _nest."""
+
+        self._block_entries = None
+        """Records of the typedef being resolved by _resolve_block."""
+
+        self._prev_compressed_info = []
+        """Arrays of the last compressed record."""
+
+    @staticmethod
+    def _new_records(parser):
+        if not parser.expand_arrays:
+            return LazyRecords()
+        if parser.columnar:
+            return ColumnarRecords()
+        return []
+
+    def resolve(self, type_name: str, uid=1) -> int:
+        """Resolve the records of the map starting with a typedef.
+
+        Args:
+            type_name: Name of the typedef of the map.
+            uid: The first uid to give to arrays in the compressed records.
+
+        Return:
+            int: The uid after the last uid given to arrays.
+        """
+        first_type = self._typedefs[type_name]
+        self._compress_uid = uid
+        self._inherit.reset(first_type)
+        for record in first_type['elements']:
+            self.resolve_record(record)
+        self._link_compressed_info([])
+        self._blocks.clear()
+        return self._compress_uid
+
+    def shift_uids(self, offset: int):
+        """Add an offset to the array uids of the compressed records.
+
+        This is used to merge maps that were resolved independently.
+        """
+        for crec in self.compressed_records:
+            for info in crec.get('compressed_info', ()):
+                info['uid'] += offset
+
+    def _push_array(self, record):
+        self._compress_array.append({'size': record['resolved_array_size'],
+                                     'stride': record['resolved_type_size'],
+                                     'uid': self._compress_uid})
+        self._compress_uid += 1
+
+    def _array_indexes(self, record):
+        """Get the indexes of an array to resolve.
+
+        If arrays are not expanded only the first element is resolved, then
+        the map offset and array uids are advanced as if all elements were.
+        """
+        size = record['resolved_array_size']
+        if self.expand_arrays:
+            yield from range(size)
+            return
+        uid = self._compress_uid
+        yield 0
+        self._compress_uid += (size - 1) * (self._compress_uid - uid)
+        self._map_offset += (size - 1) * record['resolved_type_size']
+
+    def _arr_nest(self, record):
+        self._push_array(record)
+        for idx in self._array_indexes(record):
+            self._compress_array[-1]['idx'] = idx
+            old_prefix = self._record_prefix
+            self._record_prefix = self._join_prefix(f'{record["name"]}[{idx}]')
+            self._nest(record['resolved_type'])
+            self._record_prefix = old_prefix
+        del self._compress_array[-1]
+
+    def _single_nest(self, record, rtype):
+        old_prefix = self._record_prefix
+        self._record_prefix = self._join_prefix(f'{record["name"]}')
+        self._nest(rtype)
+        self._record_prefix = old_prefix
+
+    def _nest(self, td_name):
+        """Add the records of a typedef instance at the current offset.
+
+        If a typedef is used more than once at the same inheritance level its
+        records are resolved once, relative to the instance. Each further
+        instance then only adds the prefix, offset and array uids of the
+        instance to them.
+        """
+        key = (id(self._inherit.top), td_name)
+        if key not in self._blocks:
+            # Most typedefs are used once, so only keep the records of those
+            # that are used again
+            self._blocks[key] = None
+            for element in self._typedefs[td_name]['elements']:
+                self.resolve_record(element)
+            return
+        if self._blocks[key] is None:
+            self._blocks[key] = self._resolve_block(td_name)
+        self._stamp_block(self._blocks[key])
+
+    def _stamp_block(self, block):
+        entries, size, uids, _ = block
+        offset = self._map_offset
+        uid = self._compress_uid
+        # Only records of the first array elements need their arrays
+        first = all(val['idx'] == 0 for val in self._compress_array)
+        keep_arrays = self._block_entries is not None or not self.expand_arrays
+        for rec, name, arrays, rec_first in entries:
+            new_rec = self._stamp_record(rec, name, offset)
+            if keep_arrays or (first and rec_first):
+                self._add_rec(new_rec, self._compress_array +
+                              [{**val, 'uid': val['uid'] + uid}
+                               for val in arrays])
+            else:
+                self.records.append(new_rec)
+        self._map_offset += size
+        self._compress_uid += uids
+
+    def _stamp_record(self, rec, name, offset):
+        if self.compact_records:
+            return Record(rec.props, self._join_prefix(name),
+                          offset + rec['map_offset'])
+        new_rec = rec.copy()
+        new_rec['name'] = self._join_prefix(name)
+        new_rec['map_offset'] += offset
+        return new_rec
+
+    def _resolve_block(self, td_name) -> tuple:
+        """Resolve the records of a typedef relative to an instance.
+
+        Return:
+            tuple: The records with their relative names and arrays, the size
+                   and the amount of array uids of the typedef and the
+                   inheritance level to keep it alive.
+        """
+        state = (self._map_offset, self._record_prefix, self._compress_array,
+                 self._compress_uid, self._block_entries)
+        self._map_offset = 0
+        self._record_prefix = None
+        self._compress_array = []
+        self._compress_uid = 0
+        self._block_entries = []
+        for element in self._typedefs[td_name]['elements']:
+            self.resolve_record(element)
+        block = (self._block_entries, self._map_offset, self._compress_uid,
+                 self._inherit.top)
+        (self._map_offset, self._record_prefix, self._compress_array,
+         self._compress_uid, self._block_entries) = state
+        return block
+
+    def _arr_bf_(self, record):
+        self._push_array(record)
+        for idx in self._array_indexes(record):
+            self._compress_array[-1]['idx'] = idx
+            old_prefix = self._record_prefix
+            self._record_prefix = self._join_prefix(f'{record["name"]}[{idx}]')
+            self._bitfield_record(record)
+            self._map_offset += record['resolved_type_size']
+            self._record_prefix = old_prefix
+        del self._compress_array[-1]
+
+    def _single_bf(self, record):
+        old_prefix = self._record_prefix
+        self._record_prefix = self._join_prefix(f'{record["name"]}')
+        self._bitfield_record(record)
+        self._map_offset += record['resolved_type_size']
+        self._record_prefix = old_prefix
+
+    def _arr_prim(self, record):
+        self._push_array(record)
+        for idx in self._array_indexes(record):
+            self._compress_array[-1]['idx'] = idx
+            new_rec = self._new_record(record, f'{record["name"]}[{idx}]')
+            self._map_offset += new_rec['resolved_type_size']
+            self._add_rec(new_rec)
+        del self._compress_array[-1]
+
+    def _span_prim(self, record):
+        """Add a reserved array as one record spanning all of its bytes.
+
+        Padding and reserved arrays have no data worth addressing by index,
+        so they are not expanded and exporters treat them as a gap of
+        ``resolved_total_size`` bytes.
+        """
+        record['span'] = True
+        new_rec = self._new_record(record, record['name'])
+        self._map_offset += new_rec['resolved_total_size']
+        self._add_rec(new_rec)
+
+    def _single_prim(self, record):
+        new_rec = self._new_record(record, record['name'])
+        self._map_offset += new_rec['resolved_total_size']
+        self._add_rec(new_rec)
+
+    def _join_prefix(self, name: str):
+        """Join a name to the current record prefix."""
+        if self.compact_records:
+            return RecordName(self._record_prefix, name)
+        if self._record_prefix:
+            return f'{self._record_prefix}.{name}'
+        return name
+
+    def _new_record(self, template: dict, name: str):
+        """Create a record from a template at the current map offset.
+
+        Templates are shared by all instances of a declaration, so the access
+        is resolved on the template once.
+        """
+        if 'resolved_access' not in template:
+            self._resolve_access(template)
+        if self.compact_records:
+            return Record(template, self._join_prefix(name), self._map_offset)
+        new_rec = template.copy()
+        new_rec['name'] = self._join_prefix(name)
+        new_rec['map_offset'] = self._map_offset
+        return new_rec
+
+    def resolve_record(self, record):
+        """Add the records of a typedef element at the current offset."""
+        rtype = record['resolved_type']
+        if rtype in self._typedefs.keys():
+            td_dict = self._typedefs[rtype]
+            self._inherit.push(record)
+            self._inherit.push(td_dict)
+            if 'resolved_array_size' in record:
+                self._arr_nest(record)
+            else:
+                self._single_nest(record, rtype)
+            self._inherit.pop()
+            self._inherit.pop()
+        elif rtype in self._bfs.keys():
+            bf_dict = self._bfs[rtype]
+            self._inherit.push(bf_dict)
+            if 'resolved_array_size' in record:
+                self._arr_bf_(record)
+            else:
+                self._single_bf(record)
+            self._inherit.pop()
+        elif rtype in self._primaries:
+            record = self._inherit.inherit(record)
+            if 'resolved_array_size' not in record:
+                self._single_prim(record)
+            elif record.get('reserved') and not self.expand_spans:
+                self._span_prim(record)
+            else:
+                self._arr_prim(record)
+        else:
+            raise KeyError(f'{rtype} type for map {self.name} '
+                           'does not exist')
+
+    def _try_res_perm(self, rec, permt):
+        if not isinstance(rec[permt], list):
+            rec[permt] = [rec[permt]]
+        res_perm = 0
+        for perm in rec[permt]:
+            if perm is None:
+                continue
+            if isinstance(perm, str):
+                try:
+                    rpu = self._permission_users
+                    res_perm |= rpu[perm]
+                except KeyError as exc:
+                    msg = f'permissions not recognized in {rec}'
+                    raise KeyError(msg) from exc
+            else:
+                res_perm |= int(perm)
+        if res_perm >= 0x10:
+            msg = f'{permt} must be less than 4 bits in {rec}'
+            raise ValueError(msg)
+        return res_perm
+
+    def _resolve_access(self, rec):
+        rperm = 'read_permission'
+        wperm = 'write_permission'
+        rec[f'resolved_{rperm}'] = self._try_res_perm(rec, rperm)
+        rec[f'resolved_{wperm}'] = self._try_res_perm(rec, wperm)
+
+        rec['readable'] = bool(rec[f'resolved_{rperm}'])
+        rec['writable'] = bool(rec[f'resolved_{wperm}'])
+        access = rec[f'resolved_{wperm}']
+        access |= rec[f'resolved_{rperm}'] << 4
+        rec['resolved_access'] = access
+
+    def _add_rec(self, rec, arrays=None):
+        if arrays is None:
+            arrays = self._compress_array
+        if self._block_entries is not None:
+            self._block_entries.append((rec, rec['name'],
+                                        [val.copy() for val in arrays],
+                                        all(val['idx'] == 0
+                                            for val in arrays)))
+            return
+        if self.expand_arrays:
+            self.records.append(rec)
+        else:
+            shape = [(val['uid'], val['size'], val['stride'])
+                     for val in arrays]
+            self.records.append(rec, shape)
+        if all(val['idx'] == 0 for val in arrays):
+            self._add_compressed_rec(rec, arrays)
+
+    def _add_compressed_rec(self, rec, arrays):
+        """Add the record of the first elements of its arrays compressed.
+
+        The array indexes in the name are replaced by index names, a[0].b[0]
+        becomes a[n].b[m], and the arrays are linked to the previous
+        compressed record to know where loops over them start and end.
+        """
+        crec = rec.copy()
+        infos = []
+        if arrays:
+            name_parts = crec['name'].split('[0]', len(arrays))
+            crec['name'] = name_parts[0]
+            for idx, val in enumerate(arrays):
+                idx_name = chr(ord('n') - idx)
+                crec['name'] += f'[{idx_name}]{name_parts[idx + 1]}'
+                infos.append({'size': val['size'], 'uid': val['uid'],
+                              'idx_name': idx_name, 'stride': val['stride']})
+            crec['compressed_info'] = infos
+        crec['compressed_offset'] = get_compressed_offset(crec['map_offset'],
+                                                          infos)
+        self._link_compressed_info(infos)
+        self.compressed_records.append(crec)
+
+    def _link_compressed_info(self, infos):
+        """Mark the arrays that start with a record and end before it.
+
+        Records of the same array instance are always next to each other, so
+        an array starts if the previous record is not in it and ends if the
+        next record is not.
+        """
+        prev_infos = self._prev_compressed_info
+        for level, info in enumerate(infos):
+            info['start'] = level >= len(prev_infos) or \
+                prev_infos[level]['uid'] != info['uid']
+            info['end'] = False
+        for level, info in enumerate(prev_infos):
+            if level >= len(infos) or infos[level]['uid'] != info['uid']:
+                info['end'] = True
+        self._prev_compressed_info = infos
+
+    def _bitfield_record(self, bf_rec):
+
+        bf_rec = self._bfs[bf_rec['resolved_type']]
+        t_size = bf_rec['resolved_type_size']
+        for bitfield in bf_rec['elements']:
+            bitfield = self._inherit.inherit(bitfield)
+            bitfield['resolved_type_size'] = t_size
+            # bitfields will always have a prefix because a map must start with
+            # a type
+            self._add_rec(self._new_record(bitfield, bitfield['name']))
@@ -0,0 +1,136 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Merkle style hashing of configuration data.
+
+Data is hashed as a tree of digests, a mapping is hashed from the digests of
+its keys and values and a list from the digests of its items. Like in
+:mod:`memory_map_manager.json_sem_hash` the order of keys does not matter
+and values are compared by their string representation.
+"""
+from collections.abc import Mapping
+import hashlib
+
+_LEAF = b'\x00'
+_MAPPING = b'\x01'
+_LIST = b'\x02'
+
+
+class MerkleHasher():
+    """Hashes data as a tree so shared and unchanged subtrees are reused.
+
+    Containers are memoized by their identity, so a dict referenced from many
+    places, such as a typedef used by many records, is only hashed once. The
+    data must not change while the hasher is used, use a new hasher after it
+    changed.
+
+    Example:
+        >>> hasher = MerkleHasher()
+        >>> hasher.hexdigest({'a': 1, 'b': [1, 2]}) == \\
+        ...     hasher.hexdigest({'b': [1, 2], 'a': 1})
+        True
+        >>> hasher.hexdigest({'a': 1, 'b': 2}, keys=('a',)) == \\
+        ...     hasher.hexdigest({'a': 1})
+        True
+    """
+
+    def __init__(self, algorithm='md5'):
+        """Instantiate the hasher with the name of a :mod:`hashlib` algorithm.
+        """
+        self.algorithm = algorithm
+        """Name of the hashing algorithm."""
+
+        self._memo = {}
+
+    def _hash(self, material: bytes) -> bytes:
+        return hashlib.new(self.algorithm, material).digest()
+
+    def combine(self, digests) -> bytes:
+        """Get the digest of a sequence of digests."""
+        return self._hash(_LIST + b''.join(digests))
+
+    def digest(self, data, keys=None) -> bytes:
+        """Get the digest of data.
+
+        Args:
+            data: A mapping, list, tuple or a value that is hashed as string.
+            keys: Only hash these keys of a mapping, all keys if None.
+
+        Return:
+            bytes: The digest.
+        """
+        if not isinstance(data, (Mapping, list, tuple)):
+            return self._hash(_LEAF + str(data).encode('utf-8'))
+        memo_key = (id(data), keys)
+        try:
+            return self._memo[memo_key][1]
+        except KeyError:
+            pass
+        if isinstance(data, Mapping):
+            names = sorted(data) if keys is None else \
+                sorted(key for key in keys if key in data)
+            digest = self._hash(_MAPPING + b''.join(
+                self.digest(key) + self.digest(data[key]) for key in names))
+        else:
+            digest = self.combine(self.digest(val) for val in data)
+        # Keep the data so its id cannot be reused while memoized
+        self._memo[memo_key] = (data, digest)
+        return digest
+
+    def hexdigest(self, data, keys=None) -> str:
+        """Get the digest of data as hex string, see :meth:`digest`."""
+        return self.digest(data, keys).hex()
+
+
+def get_entry_digest(hasher, entry, keys) -> bytes:
+    """Get the digest of a typedef, bitfield or enum without nesting.
+
+    The own properties are only included in the full hash, the elements are
+    projected to the keys.
+    """
+    nodes = []
+    if keys is None:
+        nodes.append(hasher.digest(entry, tuple(
+            key for key in entry if key != 'elements')))
+    for elem in entry['elements']:
+        nodes.append(hasher.digest(elem, keys))
+    return hasher.combine(nodes)
+
+
+def get_typedef_digests(hasher, typedefs, order, types, projections) -> dict:
+    """Get the digests of each typedef, bitfield and enum and projection.
+
+    Typedefs are hashed in dependency order from their own properties, their
+    elements and the digests of the typedefs, bitfields and enums used by the
+    elements, so every typedef is hashed once no matter how often it is
+    instantiated.
+
+    Args:
+        hasher: The :class:`MerkleHasher` to hash with.
+        typedefs: The resolved typedefs by name.
+        order: The typedef names in dependency order.
+        types: Dicts of the bitfields and enums by name.
+        projections: The keys the elements are projected to by hash name.
+
+    Return:
+        dict: The digests by the name of the type and the hash.
+    """
+    digests = {}
+    for entries in types:
+        for name, entry in entries.items():
+            for hash_name, keys in projections.items():
+                digests[(name, hash_name)] = \
+                    get_entry_digest(hasher, entry, keys)
+    for td_name in order:
+        typedef = typedefs[td_name]
+        for hash_name, keys in projections.items():
+            nodes = [get_entry_digest(hasher, typedef, keys)]
+            for elem in typedef['elements']:
+                for dep in (elem['resolved_type'], elem.get('enum')):
+                    if (dep, hash_name) in digests:
+                        nodes.append(digests[(dep, hash_name)])
+            digests[(td_name, hash_name)] = hasher.combine(nodes)
+    return digests
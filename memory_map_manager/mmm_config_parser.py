@@ -5,11 +5,23 @@
 # file LICENSE in the top level directory for more details.
 # SPDX-License-Identifier:    MIT
 """Parses input data to full memory map data."""
-from copy import deepcopy
 import logging
-import re
 
-from memory_map_manager.json_sem_hash import get_json_sem_hash
+from memory_map_manager.expression import ExpressionEngine
+from memory_map_manager.graph import DependencyGraph, topological_order
+from memory_map_manager.canonical_hash import get_tables_hashes
+from memory_map_manager.layout import StructLayout
+from memory_map_manager.map_resolver import MapResolver, resolve_parallel
+from memory_map_manager.merkle import MerkleHasher, get_typedef_digests
+from memory_map_manager.overrides import match_overrides, match_spans
+from memory_map_manager.profiler import profile_phase
+from memory_map_manager.records import Record, expand_spans, pin_record, \
+    stored_records
+
+
+def _copy_dict(val):
+    """Get a shallow copy of a dict, other values are returned as they are."""
+    return dict(val) if isinstance(val, dict) else val
 
 
 class MMMConfigParser():
@@ -35,7 +47,8 @@ class MMMConfigParser():
         'bits',
         'description',
         'elements',
-        'deps'
+        'deps',
+        'optimize_layout'
     ]
     """List of keys that should be inherited by other properties.
 
@@ -45,11 +58,73 @@ class MMMConfigParser():
 
     _DEFAULT_TYPE = 'uint32_t'
 
-    def __init__(self, mm_data=None):
+    FW_HASH_KEYS = ('name', 'resolved_type', 'resolved_array_size',
+                    'resolved_type_size', 'resolved_total_size',
+                    'resolved_offset')
+    """Record keys that affect the firmware hash."""
+
+    SW_HASH_KEYS = FW_HASH_KEYS + ('description',)
+    """Record keys that affect the software hash."""
+
+    # Attributes set by the steps that only depend on their own input
+    _REUSABLE_STEPS = {'defines': ('_defines', 'resolved_defs'),
+                       'metadata': ('_align', '_struct_align', '_dflt_map',
+                                    'default_type', '_meta')}
+
+    # pylint: disable-next=too-many-arguments,too-many-statements
+    def __init__(self, mm_data=None, expand_arrays=True, columnar=False,
+                 compact_records=False, *, jobs=None, profiler=None,
+                 resolved_steps=None):
         """Instantiate the parser and run if data available."""
         self.logger = logging.getLogger(self.__class__.__name__)
         """Logger the this class."""
 
+        self.expand_arrays = expand_arrays
+        """Store a record per array element in the maps.
+
+        If false the maps are :class:`LazyRecords` that store one record per
+        declaration and materialise the array element records on demand.
+        """
+
+        self.columnar = columnar
+        """Store the records of expanded maps in columns instead of dicts.
+
+        If true the maps are :class:`ColumnarRecords`, this has no effect if
+        arrays are not expanded.
+        """
+
+        self.compact_records = compact_records
+        """Store the records as :class:`Record` objects instead of dicts.
+
+        Records of the same declaration share their properties and the names
+        are stored as :class:`RecordName` with the parent name shared.
+        """
+
+        self.jobs = jobs
+        """Amount of processes to resolve maps with, serial if not set."""
+
+        self.profiler = profiler
+        """:class:`PhaseProfiler` that measures each resolve step."""
+
+        self._prev_steps = resolved_steps or {}
+        """:attr:`resolved_steps` of an earlier parser to reuse."""
+
+        self.resolved_steps = {}
+        """Input and resolved attributes of the defines and metadata steps
+        and the resolved records of each map.
+
+        self.resolved_steps['defines' | 'metadata'] = (input, attributes)
+        self.resolved_steps['maps'][map_name] = (key, uids, records,
+                                                 compressed_records, spans)
+
+        Passed to a new parser they are reused if their input did not change,
+        so regenerating after a change does not resolve them again. A map is
+        reused if its key, made of its entry, its typedef with the types
+        nested in it, its overrides, the defines and permission users, and
+        its range of array uids are the same. Reused records are shared with
+        the earlier parser.
+        """
+
         self._align = None
         """Member align value."""
 
@@ -66,6 +141,9 @@ class MMMConfigParser():
         """Resolved defines, key (define name) and val (int)."""
 
         self._defines = {}
+        self._expr = ExpressionEngine()
+        """Evaluates expressions using the resolved defines."""
+
         self._enums = {}
         """Holder of enumerations."""
 
@@ -75,9 +153,24 @@ class MMMConfigParser():
         self._tdo = []
         """List of evaluated typedef order."""
 
+        self.type_graph = DependencyGraph()
+        """Dependency graph of the typedefs, bitfields and enums."""
+
         self.typedefs = {}
         """Typedefs used for evaluation and map creation."""
 
+        self.typedef_padding = {}
+        """Padding bytes of each typedef.
+
+        self.typedef_padding[td_name]['padding' | 'total_padding' |
+                                      'total_size']
+
+        ``padding`` are the bytes added to the typedef itself and
+        ``total_padding`` also includes the padding of nested typedefs.
+        Typedefs with ``optimize_layout`` also have the ``declared_padding``
+        the members would have in declaration order.
+        """
+
         self._meta = {}
         """Holder of metadata."""
 
@@ -85,6 +178,10 @@ class MMMConfigParser():
         """Collection of records of each map.
 
         self.map[map_name][record_idx][record_properties]
+
+        Each map is a list or, depending on :attr:`expand_arrays` and
+        :attr:`columnar`, a :class:`LazyRecords` or :class:`ColumnarRecords`
+        sequence.
         """
 
         self._maps_types = {}
@@ -95,74 +192,162 @@ class MMMConfigParser():
         expanded.
         """
 
-        self._cur_map = None
-        """Current map holder for recursive eval of records."""
-
-        self._record_prefix = None
-        self._rec_parent_fields = []
-        self._compress_array = []
         self._compress_uid = 1
-        self._map_offset = 0
+        """Next uid of arrays in the compressed maps, unique over all maps."""
+
+        self._map_data = {}
+        """The generated maps the maps were resolved from."""
+
+        self._span_maps = set()
+        """Maps resolved without spans as overrides address their elements."""
+
+        self._override_data = {}
+        """The overrides of the data, part of the keys of the maps."""
+
+        self._map_keys = {}
+        """Digest of everything the records of each map depend on."""
+
+        self._map_uids = {}
+        """First and next array uid of each map."""
+
+        self._reused_maps = set()
+        """Maps with records of an earlier parser, already overridden."""
+
+        self._overrides = {}
+
+        self.typedef_hashes = {}
+        """Merkle hashes of each typedef including the types nested in it.
+
+        self.typedef_hashes[td_name]['full_hash' | 'fw_hash' | 'sw_hash']
+        """
+
+        self.map_hashes = {}
+        """Merkle hashes of each map, from its typedef and overrides.
+
+        self.map_hashes[map_name]['full_hash' | 'fw_hash' | 'sw_hash']
+        """
+
         if mm_data:
             self.resolve_all_data(mm_data)
 
     def _resolve_hashes(self):
-        fw_keys = [
-            'name',
-            'resolved_type',
-            'resolved_array_size',
-            'resolved_type_size',
-            'resolved_total_size',
-            'resolved_offset',
-            'resolved_type'
-        ]
-        sw_keys = [
-            'name',
-            'resolved_type',
-            'resolved_array_size',
-            'resolved_type_size',
-            'resolved_total_size',
-            'resolved_offset',
-            'resolved_type',
-            'description'
-        ]
-        self._meta['full_hash'] = get_json_sem_hash(self.maps)
-        fw_map = {}
-        sw_map = {}
-        for map_key, records in self.maps.items():
-            fw_map[map_key] = []
-            sw_map[map_key] = []
-            for record in records:
-                fw_records = {}
-                for key in fw_keys:
-                    if key in record:
-                        fw_records[key] = record[key]
-                fw_map[map_key].append(fw_records)
-
-                sw_records = {}
-                for key in sw_keys:
-                    if key in record:
-                        sw_records[key] = record[key]
-                sw_map[map_key].append(sw_records)
-        self._meta['fw_hash'] = get_json_sem_hash(fw_map)
-        self._meta['sw_hash'] = get_json_sem_hash(sw_map)
+        self._resolve_merkle_hashes()
+        algorithm = self._meta.get('hash_algorithm', 'md5')
+        # The records are only read one at a time, so lazy and columnar maps
+        # are not expanded into dicts for hashing. Spans are hashed as the
+        # records of their elements to keep the hashes of existing maps.
+        projections = {'full_hash': None,
+                       'fw_hash': self.FW_HASH_KEYS,
+                       'sw_hash': self.SW_HASH_KEYS}
+        tables = {name: expand_spans(records)
+                  for name, records in self.maps.items()}
+        self._meta.update(get_tables_hashes(tables, projections, algorithm,
+                                            compat=algorithm == 'md5'))
         ver = self._meta['version'].split('.')
         self._meta['major_version'] = int(ver[0])
         self._meta['minor_version'] = int(ver[1])
         self._meta['patch_version'] = int(ver[2])
 
+    def _resolve_merkle_hashes(self):
+        """Hash the typedefs and maps as a tree of digests.
+
+        A map is hashed from the hash of its typedef and its overrides, so the
+        records do not need to be hashed.
+        """
+        hasher = MerkleHasher(self._meta.get('hash_algorithm', 'md5'))
+        projections = {'full_hash': None,
+                       'fw_hash': self.FW_HASH_KEYS,
+                       'sw_hash': self.SW_HASH_KEYS}
+        digests = get_typedef_digests(hasher, self.typedefs, self._tdo,
+                                      (self._bfs, self._enums), projections)
+        self.typedef_hashes = {
+            td_name: {hash_name: digests[(td_name, hash_name)].hex()
+                      for hash_name in projections}
+            for td_name in self._tdo}
+        self.map_hashes = {}
+        for mname, td_name in self._maps_types.items():
+            overrides = self._overrides.get(mname, {})
+            self.map_hashes[mname] = {}
+            for hash_name, keys in projections.items():
+                nodes = [digests[(td_name, hash_name)]]
+                for name in sorted(overrides):
+                    if keys is None or \
+                            any(key in overrides[name] for key in keys):
+                        nodes.append(hasher.digest(name))
+                        nodes.append(hasher.digest(overrides[name], keys))
+                if keys is None:
+                    nodes.append(hasher.digest(self._defines))
+                    nodes.append(hasher.digest(
+                        self._meta.get('resolved_permission_users', {})))
+                self.map_hashes[mname][hash_name] = \
+                    hasher.combine(nodes).hex()
+
+    @staticmethod
+    def _copy_entries(entries: dict) -> dict:
+        """Copy the parts of entries that resolving writes to.
+
+        The entries and their elements are copied, values nested deeper are
+        only read so they are shared with the input data.
+        """
+        copied = {}
+        for key, entry in entries.items():
+            if isinstance(entry, dict):
+                entry = entry.copy()
+                if 'elements' in entry:
+                    entry['elements'] = [
+                        ele.copy() if isinstance(ele, dict) else ele
+                        for ele in entry['elements']]
+            copied[key] = entry
+        return copied
+
     def resolve_all_data(self, data):
-        """Resolve data info to provide a fully parsed config."""
-        data = deepcopy(data)
-        self.resolve_defines(data.get('defines', {}))
-        self.resolve_metadata(data.get('metadata', {}))
-        self.resolve_enumerations(data.get('enums', {}))
-        self.resolve_bitfields(data.get('bitfields', {}))
-        self.resolve_typedefs(data.get('typedefs', {}))
-        self.resolve_maps(data.get('generated_maps', {}))
-        self._resolve_overrides(data.get('overrides', {}))
-        self._resolve_records_post()
-        self._resolve_hashes()
+        """Resolve data info to provide a fully parsed config.
+
+        The data is not changed, only the parts that get resolved are copied.
+        """
+        steps = ((self.resolve_defines, 'defines', self._copy_entries),
+                 (self.resolve_metadata, 'metadata', dict),
+                 (self.resolve_enumerations, 'enums', self._copy_entries),
+                 (self.resolve_bitfields, 'bitfields', self._copy_entries),
+                 (self.resolve_typedefs, 'typedefs', self._copy_entries),
+                 (self.resolve_maps, 'generated_maps', None),
+                 (self._resolve_overrides, 'overrides', self._copy_entries))
+        self._override_data = data.get('overrides', {})
+        for step, key, copy in steps:
+            with profile_phase(self.profiler, step.__name__):
+                entries = data.get(key, {})
+                if self._reuse_step(key, entries):
+                    continue
+                step(entries if copy is None else copy(entries))
+                if key in self._REUSABLE_STEPS:
+                    self.resolved_steps[key] = (entries, {
+                        attr: _copy_dict(getattr(self, attr))
+                        for attr in self._REUSABLE_STEPS[key]})
+        for step in (self._resolve_records_post, self._resolve_hashes):
+            with profile_phase(self.profiler, step.__name__):
+                step()
+        self.resolved_steps['maps'] = {
+            mname: (self._map_keys[mname], self._map_uids[mname], records,
+                    self._c_maps[mname], mname in self._span_maps)
+            for mname, records in self.maps.items()}
+
+    def _reuse_step(self, key, entries) -> bool:
+        """Take the resolved attributes of a step from an earlier parser.
+
+        Unchanged input is mostly made of the same objects as the input of
+        the earlier parser, so comparing it is cheap.
+
+        Return:
+            bool: True if the step was resolved from the same input before.
+        """
+        resolved = self._prev_steps.get(key)
+        if resolved is None or resolved[0] != entries:
+            return False
+        # Later steps add to the metadata, so each parser gets its own dicts
+        for attr, val in resolved[1].items():
+            setattr(self, attr, _copy_dict(val))
+        self.resolved_steps[key] = resolved
+        return True
 
     def get_cfg(self):
         """Get the full parsed configuration.
@@ -208,16 +393,38 @@ class MMMConfigParser():
                            'between enums and bitfields')
 
     def _resolve_overrides(self, overrides):
+        map_overrides = {}
         for record_name, data in overrides.items():
-            found_match = False
             data['map'] = data.get('map', self._dflt_map)
-            for record in self.maps[data['map']]:
-                if record_name.startswith('r"') and record_name.endswith('"'):
-                    reg_pattern = record_name[2:-1]
-                    if not re.search(rf"{reg_pattern}", record['name']):
-                        continue
-                elif record['name'] != record_name:
-                    continue
+            map_overrides.setdefault(data['map'], {})[record_name] = data
+        self._overrides = map_overrides
+        span_maps = {mname for mname, ovrs in map_overrides.items()
+                     if mname in self.maps and mname not in self._span_maps
+                     and mname not in self._reused_maps
+                     and match_spans(self.maps[mname], ovrs)}
+        if span_maps:
+            # The records of the elements only exist with the spans expanded,
+            # the maps are resolved again to keep the array uids in order
+            self._span_maps |= span_maps
+            self.maps = {}
+            self._c_maps = {}
+            self._compress_uid = 1
+            self._reused_maps = set()
+            self.resolve_maps(self._map_data)
+        matches = {}
+        for record_name, data in overrides.items():
+            if data['map'] in self._reused_maps:
+                continue
+            records = self.maps[data['map']]
+            if data['map'] not in matches:
+                matches[data['map']] = match_overrides(
+                    records, map_overrides[data['map']])
+            idxs = matches[data['map']][record_name]
+            if not idxs:
+                raise KeyError(f'{record_name} '
+                               'override did not match anything')
+            for idx in idxs:
+                record = pin_record(records, idx)
                 new_rec = data.copy()
                 del new_rec['map']
                 new_rec['default_changed'] = False
@@ -225,46 +432,36 @@ class MMMConfigParser():
                     new_rec['default_changed'] = True
 
                 record.update(new_rec)
-                found_match = True
-            if not found_match:
-                raise KeyError(f'{record_name} '
-                               'override did not match anything')
-
-    def _rm_res_keys(self, typedef: dict) -> dict:
-        inherit_prop = {}
-        for key, val in typedef.items():
-            if key not in self.RESERVED_KEYS:
-                inherit_prop[key] = val
-
-        return inherit_prop
-
-    def _inherit_record(self, record: dict):
-        all_props = {}
-        for ovr in self._rec_parent_fields:
-            all_props.update(ovr)
-        all_props.update(record)
-        return all_props
 
     def resolve_maps(self, maps):
-        """Calculate offsets of records for map data."""
+        """Calculate offsets of records for map data.
+
+        Maps with the same key and array uids as in the :attr:`resolved_steps`
+        of an earlier parser take its records instead of being resolved.
+        """
         if not maps:
             raise KeyError("At least 1 generated map is required")
-        for mname, mmap in maps.items():
-            self._map_offset = 0
-            self._cur_map = mname
-            self.maps[mname] = []
-            self._c_maps[mname] = []
+        self._map_data = maps
+        for mmap in maps.values():
             first_type = self.typedefs[mmap['type']]
-            self._maps_types[mname] = mmap['type']
             # Add default values to the parent so it can propagate
             first_type['read_permission'] = first_type.get('read_permission',
                                                            0)
             first_type['write_permission'] = first_type.get('write_permission',
                                                             0)
-            self._rec_parent_fields = [self._rm_res_keys(first_type)]
-            for record in first_type['elements']:
-                self._resolve_records(record)
-            self._find_compress_changes(self._c_maps[mname])
+        self._map_keys = self._get_map_keys(maps)
+        prev = self._prev_steps.get('maps', {})
+        resolvers = {mname: self._new_resolver(mname) for mname in maps
+                     if prev.get(mname, (None,))[0] != self._map_keys[mname]}
+        uids = {}
+        if self.jobs and self.jobs > 1 and len(resolvers) > 1:
+            uids = resolve_parallel(resolvers, maps, self.jobs)
+        for mname, mmap in maps.items():
+            uid = self._compress_uid
+            self._maps_types[mname] = mmap['type']
+            if not self._reuse_map(mname, prev.get(mname)):
+                self._add_map(mname, resolvers.get(mname), uids)
+            self._map_uids[mname] = (uid, self._compress_uid)
         if self._dflt_map is not None:
             if self._dflt_map not in maps.keys():
                 raise KeyError(f'default map {self._dflt_map} '
@@ -272,217 +469,64 @@ class MMMConfigParser():
         if len(maps) == 1:
             self._dflt_map = list(maps.keys())[0]
 
-    def _arr_nest(self, record, td_dict):
-        self._compress_array.append({'size': record['resolved_array_size'],
-                                     'uid': self._compress_uid})
-        self._compress_uid += 1
-        for idx in range(record['resolved_array_size']):
-            self._compress_array[-1]['idx'] = idx
-            old_prefix = self._record_prefix
-            name = f'{record["name"]}[{idx}]'
-            if self._record_prefix:
-                self._record_prefix = f'{self._record_prefix}.{name}'
-            else:
-                self._record_prefix = name
-            for element in td_dict['elements']:
-                self._resolve_records(element)
-            self._record_prefix = old_prefix
-        del self._compress_array[-1]
-
-    def _single_nest(self, record, rtype):
-        old_prefix = self._record_prefix
-        name = f'{record["name"]}'
-        if self._record_prefix:
-            self._record_prefix = f'{self._record_prefix}.{name}'
-        else:
-            self._record_prefix = name
-        for element in self.typedefs[rtype]['elements']:
-            self._resolve_records(element)
-        self._record_prefix = old_prefix
-
-    def _arr_bf_(self, record):
-        self._compress_array.append({'size': record['resolved_array_size'],
-                                     'uid': self._compress_uid})
-        self._compress_uid += 1
-        for idx in range(record['resolved_array_size']):
-            self._compress_array[-1]['idx'] = idx
-            old_prefix = self._record_prefix
-            name = f'{record["name"]}[{idx}]'
-            if self._record_prefix:
-                self._record_prefix = f'{self._record_prefix}.{name}'
-            else:
-                self._record_prefix = name
-            self._bitfield_record(record)
-            self._map_offset += record['resolved_type_size']
-            self._record_prefix = old_prefix
-        del self._compress_array[-1]
-
-    def _single_bf(self, record):
-        old_prefix = self._record_prefix
-        name = f'{record["name"]}'
-        if self._record_prefix:
-            self._record_prefix = f'{self._record_prefix}.{name}'
+    def _add_map(self, mname, resolver, uids: dict):
+        """Add the records of a map resolved by a worker or resolve it."""
+        if resolver is None:
+            resolver = self._new_resolver(mname)
+        if mname in uids:
+            resolver.shift_uids(self._compress_uid - 1)
+            self._compress_uid += uids[mname]
         else:
-            self._record_prefix = name
-        self._bitfield_record(record)
-        self._map_offset += record['resolved_type_size']
-        self._record_prefix = old_prefix
-
-    def _arr_prim(self, record):
-        self._compress_array.append({'size': record['resolved_array_size'],
-                                     'uid': self._compress_uid})
-        self._compress_uid += 1
-        for idx in range(record['resolved_array_size']):
-            self._compress_array[-1]['idx'] = idx
-            new_rec = record.copy()
-            new_rec['name'] = f'{new_rec["name"]}[{idx}]'
-            if self._record_prefix:
-                new_rec['name'] = f'{self._record_prefix}.{new_rec["name"]}'
-            new_rec['map_offset'] = self._map_offset
-            self._map_offset += new_rec['resolved_type_size']
-            self._add_rec(new_rec)
-        del self._compress_array[-1]
-
-    def _single_prim(self, record):
-        new_rec = record.copy()
-        if self._record_prefix:
-            new_rec['name'] = f'{self._record_prefix}.{new_rec["name"]}'
-        new_rec['map_offset'] = self._map_offset
-        self._map_offset += new_rec['resolved_total_size']
-        self._add_rec(new_rec)
-
-    def _resolve_records(self, record) -> list:
-        rtype = record['resolved_type']
-        if rtype in self.typedefs.keys():
-            td_dict = self.typedefs[rtype]
-            self._rec_parent_fields.append(self._rm_res_keys(record))
-            self._rec_parent_fields.append(self._rm_res_keys(td_dict))
-            if 'resolved_array_size' in record:
-                self._arr_nest(record, td_dict)
-            else:
-                self._single_nest(record, rtype)
-            del self._rec_parent_fields[-1]
-            del self._rec_parent_fields[-1]
-        elif rtype in self._bfs.keys():
-            bf_dict = self._bfs[rtype]
-            self._rec_parent_fields.append(self._rm_res_keys(bf_dict))
-            if 'resolved_array_size' in record:
-                self._arr_bf_(record)
-            else:
-                self._single_bf(record)
-            del self._rec_parent_fields[-1]
-        elif rtype in self.PRIMARIES:
-            record = self._inherit_record(record)
-            if 'resolved_array_size' in record:
-                self._arr_prim(record)
-            else:
-                self._single_prim(record)
-        else:
-            raise KeyError(f'{rtype} type for map {self._cur_map} '
-                           'does not exist')
-
-    def _try_res_perm(self, rec, permt):
-        if not isinstance(rec[permt], list):
-            rec[permt] = [rec[permt]]
-        res_perm = 0
-        for perm in rec[permt]:
-            if perm is None:
-                continue
-            if isinstance(perm, str):
-                try:
-                    rpu = self._meta['resolved_permission_users']
-                    res_perm |= rpu[perm]
-                except KeyError as exc:
-                    msg = f'permissions not recognized in {rec}'
-                    raise KeyError(msg) from exc
-            else:
-                res_perm |= int(perm)
-        if res_perm >= 0x10:
-            msg = f'{permt} must be less than 4 bits in {rec}'
-            raise ValueError(msg)
-        return res_perm
-
-    def _add_rec(self, rec):
-        rperm = 'read_permission'
-        wperm = 'write_permission'
-        rec[f'resolved_{rperm}'] = self._try_res_perm(rec, rperm)
-        rec[f'resolved_{wperm}'] = self._try_res_perm(rec, wperm)
-
-        rec['readable'] = bool(rec[f'resolved_{rperm}'])
-        rec['writable'] = bool(rec[f'resolved_{wperm}'])
-        access = rec[f'resolved_{wperm}']
-        access |= rec[f'resolved_{rperm}'] << 4
-        rec['resolved_access'] = access
-
-        self.maps[self._cur_map].append(rec)
-        crec = rec.copy()
-        if len(self._compress_array) > 0:
-            if all(d['idx'] == 0 for d in self._compress_array):
-                # Rename a[0].b[0] to a[n].b[m]
-                crec['compressed_info'] = []
-                crec['compressed_offset'] = f'{crec["map_offset"]}'
-                for idx, val in enumerate(self._compress_array):
-                    idx_name = chr(ord('n') - idx)
-                    crec['name'] = crec['name'].replace('[0]',
-                                                        f'[{idx_name}]',
-                                                        1)
-                    msg = f'+{val["size"]}*{idx_name}'
-                    crec['compressed_offset'] += msg
-                    tmp = val.copy()
-                    tmp['idx_name'] = idx_name
-                    del tmp['idx']
-                    crec['compressed_info'].append(tmp)
-                self._c_maps[self._cur_map].append(crec)
-        else:
-            crec['compressed_offset'] = f'{crec["map_offset"]}'
-            self._c_maps[self._cur_map].append(crec)
-
-    def _find_compress_changes(self, records):
-        """Calculate when a new array starts and ends.
-
-        This is used for generating opening and closing for loop generation.
+            self._compress_uid = resolver.resolve(self._maps_types[mname],
+                                                  self._compress_uid)
+        self.maps[mname] = resolver.records
+        self._c_maps[mname] = resolver.compressed_records
+
+    def _new_resolver(self, mname) -> MapResolver:
+        return MapResolver(self, mname, self._bfs,
+                           self._meta['resolved_permission_users'],
+                           expand_spans=mname in self._span_maps)
+
+    def _get_map_keys(self, maps) -> dict:
+        """Get the digest of everything the records of each map depend on."""
+        hasher = MerkleHasher(self._meta.get('hash_algorithm', 'md5'))
+        digests = get_typedef_digests(hasher, self.typedefs, self._tdo,
+                                      (self._bfs, self._enums),
+                                      {'full_hash': None})
+        dflt_map = next(iter(maps)) if len(maps) == 1 else self._dflt_map
+        overrides = {}
+        for name, data in self._override_data.items():
+            overrides.setdefault(data.get('map', dflt_map), {})[name] = data
+        nodes = [hasher.digest(self._defines),
+                 hasher.digest(self._meta['resolved_permission_users']),
+                 hasher.digest([self.expand_arrays, self.columnar,
+                                self.compact_records])]
+        return {mname: hasher.combine(nodes + [
+            hasher.digest(mmap), digests[(mmap['type'], 'full_hash')],
+            hasher.digest(overrides.get(mname, {}))])
+            for mname, mmap in maps.items()}
+
+    def _reuse_map(self, mname, resolved) -> bool:
+        """Take the records of a map from an earlier parser.
+
+        Return:
+            bool: True if the map was resolved with the same key and uids.
         """
-        old_uid = []
-        keyci = 'compressed_info'
-        for idx, rec in enumerate(records):
-            if keyci not in rec:
-                continue
-            for info_idx, info in enumerate(rec[keyci]):
-                info['start'] = False
-                uid = info['uid']
-                if info_idx >= len(old_uid):
-                    old_uid.append(-1)
-                old_uid.extend([-1] * info_idx)
-                if old_uid[info_idx] != uid:
-                    info['start'] = True
-                    old_uid[info_idx] = uid
-
-                info['end'] = False
-                try:
-
-                    if records[idx + 1][keyci][info_idx]['uid'] != uid:
-                        info['end'] = True
-                        del old_uid[-1]
-                except (KeyError, IndexError):
-                    info['end'] = True
-                    del old_uid[-1]
-
-    def _bitfield_record(self, bf_rec):
-
-        bf_rec = self._bfs[bf_rec['resolved_type']]
-        t_size = bf_rec['resolved_type_size']
-        for bitfield in bf_rec['elements']:
-            bitfield = self._inherit_record(bitfield)
-            new_rec = bitfield.copy()
-            # bitfields will always have a prefix because a map must start with
-            # a type
-            new_rec['name'] = f'{self._record_prefix}.{new_rec["name"]}'
-            new_rec['map_offset'] = self._map_offset
-            new_rec['resolved_type_size'] = t_size
-            self._add_rec(new_rec)
+        if resolved is None or resolved[0] != self._map_keys[mname] or \
+                resolved[1][0] != self._compress_uid:
+            return False
+        _, (_, self._compress_uid), self.maps[mname], self._c_maps[mname], \
+            spans = resolved
+        if spans:
+            self._span_maps.add(mname)
+        self._reused_maps.add(mname)
+        return True
 
     def resolve_defines(self, defines):
-        """Resolve defines using the unsafe eval.
+        """Resolve defines by evaluating their expressions.
+
+        The names each define refers to are collected from its expression so
+        every define is evaluated once, after the defines it depends on.
 
         Example:
             input = [
@@ -512,44 +556,59 @@ class MMMConfigParser():
         """
         resolved_defs = self.resolved_defs
         self._defines = defines
-        while True:
-            def_count = len(resolved_defs)
-            finished = True
-            for key in sorted(defines):
-                if not isinstance(defines[key], dict):
-                    defines[key] = {'value': defines[key]}
-                val = defines[key]['value']
-                try:
-                    if isinstance(val, str):
-                        if (val[0] != "\"" or val[-1] != "\""):
-                            val = eval(val, None, resolved_defs)
-
-                    resolved_defs[key] = val
-                    defines[key]['resolved_value'] = val
-                except (ValueError, NameError, TypeError):
-                    finished = False
-                    self.logger.debug("Cannot resolved on this pass")
-
-            if finished:
-                break
-            if def_count == len(resolved_defs):
-                missing_deps = set(defines.keys()) - set(resolved_defs.keys())
-                raise RecursionError(f'Cannot resolve {missing_deps} defines '
-                                     'due to missing definition/circular '
-                                     'dependency')
-
-    def _calc_td_elements(self, td_name, tds):
-        elements = tds[td_name]['elements']
+        self._expr.clear()
+        deps = {}
+        for key in defines:
+            if not isinstance(defines[key], dict):
+                defines[key] = {'value': defines[key]}
+            deps[key] = self._get_define_deps(defines[key]['value'])
+        try:
+            order = topological_order(deps)
+        except RecursionError as exc:
+            raise RecursionError(f'Cannot resolve defines due to {exc}') \
+                from exc
+        for key in order:
+            val = defines[key]['value']
+            # Expressions that are not allowed or fail to evaluate keep their
+            # own ValueError
+            try:
+                if self._is_define_expr(val):
+                    val = self._expr.evaluate(val, resolved_defs)
+            except (NameError, TypeError) as exc:
+                raise RecursionError(f'Cannot resolve {key} define due to '
+                                     f'missing definition: {exc}') from exc
+            resolved_defs[key] = val
+            defines[key]['resolved_value'] = val
+
+    @staticmethod
+    def _is_define_expr(val) -> bool:
+        """Check if a define value needs to be evaluated.
+
+        Strings with surrounding quotes are kept as is.
+        """
+        return isinstance(val, str) and (val[0] != "\"" or val[-1] != "\"")
+
+    def _get_define_deps(self, val) -> frozenset:
+        """Get the names an expression of a define refers to."""
+        if not self._is_define_expr(val):
+            return frozenset()
+        return self._expr.get_names(val)
+
+    def _calc_td_elements(self, td_name, tds) -> list:
+        """Resolve the types and sizes of the elements of a typedef."""
         tds[td_name]['use_bitfields'] = False
         tds[td_name]['use_enums'] = False
         use_defines = False
-        deps = []
-        offset = 0
-        pad = 0
-        for idx, ele in enumerate(elements.copy()):
+        deps = set()
+        elements = []
+        for ele in tds[td_name]['elements']:
             # Handle default, with only a name provided
             if isinstance(ele, str):
                 ele = {'name': ele}
+            else:
+                # Referenced typedefs share their element dicts, the layout
+                # of each typedef must only change its own
+                ele = dict(ele)
 
             r_type = ele.get('type', self.default_type)
             multi = 1
@@ -572,104 +631,155 @@ class MMMConfigParser():
                 r_type = self._enums[r_type]['resolved_type']
             else:
                 t_size = tds[r_type]['resolved_total_size']
-                deps.append(r_type)
+                deps.add(r_type)
             ele['resolved_total_size'] = t_size * multi
             ele['resolved_type_size'] = t_size
-            ele['resolved_offset'] = offset
             ele['resolved_type'] = r_type
-            offset += t_size * multi
-            elements[idx+pad] = ele
-            if self._align:
-                pad_size = self._align - offset % self._align
-                if offset % self._align != 0:
-                    elements.insert(idx + pad + 1,
-                                    self._get_padded_type(offset,
-                                                          pad_size,
-                                                          pad))
-                    offset += pad_size
-                    pad += 1
+            elements.append(ele)
         tds[td_name]['use_defines'] = use_defines
-        tds[td_name]['deps'] = sorted(list(set(deps)))
-        return offset
+        tds[td_name]['deps'] = sorted(deps)
+        return elements
 
     def resolve_typedefs(self, typedefs):
-        """Resolve typedef dependencies and apply default data."""
+        """Resolve typedef dependencies and apply default data.
+
+        The padding of each typedef is reported in :attr:`typedef_padding`.
+        """
         tds = typedefs
         self._resolve_reference(tds)
         self._tdo = self._resolve_typedef_order(tds)
         self.typedefs = tds
+        self.typedef_padding = {}
         for td_name in self._tdo:
-            offset = self._calc_td_elements(td_name, tds)
-            elements = tds[td_name]['elements']
-            if 'total_size' in tds[td_name]:
-                tot_size = tds[td_name]['total_size']
-                if offset > tot_size:
-                    raise ValueError(f'{td_name} total size limit ({tot_size})'
-                                     f' exceeds calculated size {offset}')
-                if offset < tot_size:
-                    pad_size = tot_size - offset
-                    elements.append(self._get_padded_type(offset, pad_size))
-                tds[td_name]['resolved_total_size'] = tot_size
-            elif self._struct_align:
-                pad_size = self._struct_align - offset % self._struct_align
-                if offset % self._struct_align != 0:
-                    elements.append(self._get_padded_type(offset, pad_size))
-                tds[td_name]['resolved_total_size'] = offset + pad_size
-            else:
-                tds[td_name]['resolved_total_size'] = offset
-            self._assert_unique_elements(elements, td_name)
+            elements = self._calc_td_elements(td_name, tds)
+            layout = self._layout_typedef(td_name, elements)
+            tds[td_name]['resolved_total_size'] = layout.total_size
+            tds[td_name]['elements'] = layout.elements
+            self._assert_unique_elements(layout.elements, td_name)
+            self.typedef_padding[td_name] = self._get_padding(td_name,
+                                                              layout)
         self._check_unique_types()
 
-    def _get_padded_type(self, offset: int, size: int, name=None) -> dict:
-        if name is not None:
-            name = f'padding_{name}'
-        else:
-            name = 'padding'
-        return {
-            'name': name,
-            'description': 'padding bytes',
-            'reserved': True,
-            'resolved_array_size': size,
-            'resolved_offset': offset,
-            'resolved_type_size': 1,
-            'resolved_type': 'uint8_t',
-            'resolved_total_size': size
-        }
+    def _layout_typedef(self, td_name, elements) -> StructLayout:
+        """Place the elements of a typedef, reordered if it is optimized.
+
+        Optimized typedefs use natural alignment with the members sorted by
+        :meth:`StructLayout.reorder`, this only has an effect if the member
+        align is set.
+        """
+        typedef = self.typedefs[td_name]
+        optimize = bool(typedef.get('optimize_layout') and self._align)
+        layout = StructLayout(self._align, self._struct_align,
+                              typedef.get('total_size'), natural=optimize)
+        if optimize:
+            declared = StructLayout(self._align, self._struct_align,
+                                    typedef.get('total_size'))
+            for ele in elements:
+                declared.add(dict(ele))
+            try:
+                declared.finish()
+            except ValueError:
+                # Only the optimized order fits the total size, the declared
+                # padding is the one that does not fit
+                pass
+            elements = StructLayout.reorder(elements, self._align)
+        for ele in elements:
+            layout.add(ele)
+        try:
+            layout.finish()
+        except ValueError as exc:
+            raise ValueError(f'{td_name} {exc}') from exc
+        if optimize:
+            self.logger.info("Reordered %s to %r, padding %d -> %d bytes",
+                             td_name, [ele['name'] for ele in elements],
+                             declared.padding, layout.padding)
+            layout.declared_padding = declared.padding
+        return layout
+
+    def _get_padding(self, td_name, layout: StructLayout) -> dict:
+        """Get the padding bytes of a typedef including nested typedefs."""
+        nested = 0
+        for ele in layout.elements:
+            if ele['resolved_type'] in self.typedef_padding:
+                nested += ele.get('resolved_array_size', 1) * \
+                    self.typedef_padding[ele['resolved_type']]['total_padding']
+        padding = {'padding': layout.padding,
+                   'total_padding': layout.padding + nested,
+                   'total_size': layout.total_size}
+        if layout.natural:
+            padding['declared_padding'] = layout.declared_padding
+        if padding['total_padding']:
+            self.logger.debug("%s has %d of %d bytes padding", td_name,
+                              padding['total_padding'], layout.total_size)
+        return padding
 
     def _resolve_typedef_order(self, typedefs):
-        """Resolve the inherit property of the typedefs."""
-        known_types = list(self.PRIMARIES.keys())
-        kbfe = list(self._bfs.keys())
-        kbfe.extend(self._enums.keys())
-        unresolved_types = []
-        while True:
-            type_count = len(known_types)
-            finished = True
-            for td_name in sorted(typedefs.keys()):
-                if td_name not in known_types:
-                    for ele in typedefs[td_name]['elements']:
-                        if isinstance(ele, str):
-                            ele = {'name': ele}
-                        r_type = ele.get('type', self.default_type)
-                        if r_type not in known_types and r_type not in kbfe:
-                            finished = False
-                            unresolved_types.append(r_type)
-                            break
-                    else:
-                        known_types.append(td_name)
-                        if td_name in unresolved_types:
-                            unresolved_types.remove(td_name)
-
-            if finished:
-                break
-            if type_count == len(known_types):
-                unresolved_types = list(set(unresolved_types))
-                missing_deps = list(set(typedefs.keys()) - set(known_types))
-                raise RecursionError(f'Cannot resolve {missing_deps} typedefs '
-                                     'due to missing definition/circular '
-                                     f'dependency/typo. {unresolved_types} '
-                                     'types are not resolved.')
-        return [x for x in known_types if x not in self.PRIMARIES]
+        """Resolve the order of typedefs so dependencies come first.
+
+        The dependencies are sorted with Kahn's algorithm and then ordered the
+        same way as resolving typedefs in passes over the sorted names would.
+        """
+        graph = DependencyGraph()
+        for name in sorted(self._bfs):
+            graph.add(name)
+        for name in sorted(self._enums):
+            graph.add(name)
+        missing = {}
+        for td_name in sorted(typedefs):
+            deps = self._get_typedef_deps(typedefs[td_name])
+            graph.add(td_name, deps)
+            for dep in deps:
+                if dep not in typedefs and dep not in graph:
+                    missing.setdefault(td_name, set()).add(dep)
+        if missing:
+            raise RecursionError(f'Cannot resolve {sorted(missing)} typedefs '
+                                 'due to missing definition/typo. '
+                                 f'{sorted(set().union(*missing.values()))} '
+                                 'types are not resolved.')
+        try:
+            order = graph.topological_order()
+        except RecursionError as exc:
+            raise RecursionError(f'Cannot resolve typedefs due to {exc}') \
+                from exc
+        self.type_graph = graph
+        return self._order_in_passes(
+            [name for name in order if name in typedefs], graph)
+
+    @staticmethod
+    def _order_in_passes(order, graph) -> list:
+        """Order typedefs as resolving in passes over sorted names would.
+
+        A typedef is resolved in the first pass where all its typedef
+        dependencies are known, which are those resolved in earlier passes or
+        earlier in the same pass.
+        """
+        passes = {}
+        for name in order:
+            passes[name] = max((passes[dep] + int(dep > name)
+                                for dep in graph.get_deps(name)
+                                if dep in passes), default=0)
+        return sorted(passes, key=lambda name: (passes[name], name))
+
+    def _get_typedef_deps(self, typedef) -> set:
+        deps = set()
+        for ele in typedef['elements']:
+            if isinstance(ele, str):
+                ele = {'name': ele}
+            deps.add(ele.get('type', self.default_type))
+        return deps - self.PRIMARIES.keys()
+
+    def get_dependents(self, type_name) -> set:
+        """Get the typedefs that depend on a type, directly or indirectly.
+
+        This assumes that the typedefs have already been resolved.
+
+        Args:
+            type_name: Name of a typedef, bitfield or enum.
+
+        Return:
+            set: Names of the dependent typedefs.
+        """
+        return self.type_graph.get_dependents(type_name)
 
     def _calc_rtype(self, bit_total, r_type):
         if r_type is None:
@@ -694,7 +804,8 @@ class MMMConfigParser():
             for idx, ele in enumerate(elements):
                 if isinstance(ele, str):
                     ele = {'name': ele}
-                r_bit = eval(str(ele.get('bits', 1)), None, self.resolved_defs)
+                r_bit = self._expr.evaluate(ele.get('bits', 1),
+                                            self.resolved_defs)
                 if r_bit == 0:
                     raise ValueError(f'{ele["name"]} has 0 bits... tisk tisk')
                 ele['resolved_bit_offset'] = bit_total
@@ -800,48 +911,53 @@ class MMMConfigParser():
         self._meta = mds
 
     def _resolve_reference(self, dicts_with_elements):
+        """Insert the elements of the referenced entry at the start.
+
+        Entries are flattened in dependency order so each referenced entry is
+        already flattened and its element list is reused by every entry that
+        references it.
+        """
         dwe = dicts_with_elements
-        resolved_refs = []
-        unresolved_regs = []
-        while True:
-            resolved_refs_count = len(resolved_refs)
-            finished = True
-            for key in sorted(dwe):
-                if 'reference' in dwe[key]:
-                    ref_key = dwe[key]['reference']
-                    ele = 'elements'
-                    # inserts all elements from the reference entry to the
-                    # the start
-                    dwe[key][ele] = dwe[ref_key][ele] + dwe[key][ele]
-                    # If the referenced entry contains another entry we need
-                    # to propagate it
-                    if 'reference' in dwe[ref_key]:
-                        dwe[key]['reference'] = dwe[ref_key]['reference']
-                        finished = False
-                        unresolved_regs.append(key)
-                    else:
-                        dwe[key].pop('reference')
-                        resolved_refs.append(key)
-
-            if finished:
-                break
-            if resolved_refs_count == len(resolved_refs):
-                missing_deps = set(unresolved_regs) - set(resolved_refs)
-                raise RecursionError(f'Cannot resolve {missing_deps} '
-                                     'references due to circular dependency')
-
-    def _assert_unique_elements(self, elements, key):
-        names = []
+        refs = {key: dwe[key]['reference'] for key in dwe
+                if 'reference' in dwe[key]}
+        for key, ref_key in refs.items():
+            if ref_key not in dwe:
+                raise KeyError(f'{key} references {ref_key} which does not '
+                               'exist')
+        try:
+            order = topological_order({key: [ref_key]
+                                       for key, ref_key in refs.items()})
+        except RecursionError as exc:
+            raise RecursionError(f'Cannot resolve references due to {exc}') \
+                from exc
+        for key in order:
+            ref_key = dwe[key].pop('reference')
+            dwe[key]['elements'] = dwe[ref_key]['elements'] + \
+                dwe[key]['elements']
+
+    @staticmethod
+    def _assert_unique_elements(elements, key):
+        names = set()
         for ele in elements:
             name = ele['name']
             if name in names:
                 raise KeyError(f'Duplicate record {name} in {key}')
-            names.append(name)
+            names.add(name)
 
     def _resolve_records_post(self):
-        for records in self.maps.values():
-            for rec in records:
-                self._resolve_record_props(rec)
+        shared = {}
+        for mname, records in self.maps.items():
+            if mname in self._reused_maps:
+                continue
+            for rec in stored_records(records):
+                if isinstance(rec, Record) and not rec.changed:
+                    shared[id(rec.props)] = rec.props
+                else:
+                    self._resolve_record_props(rec)
+        # Unchanged compact records share their properties so resolve the
+        # properties once instead of copying them to every record
+        for props in shared.values():
+            self._resolve_record_props(props)
 
     def _resolve_record_props(self, rec):
         self._eval_with_defs(rec, 'scaling_factor')
@@ -852,7 +968,8 @@ class MMMConfigParser():
     def _eval_with_defs(self, rec, key):
         if key not in rec:
             return False
-        rec[f'resolved_{key}'] = eval(str(rec[key]), None, self.resolved_defs)
+        rec[f'resolved_{key}'] = self._expr.evaluate(rec[key],
+                                                     self.resolved_defs)
         if rec[key] != rec[f'resolved_{key}']:
             return True
         return False
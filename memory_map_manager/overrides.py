@@ -0,0 +1,104 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Matching of override names to the records of a map.
+
+Override names are either exact record names or regular expressions written
+as ``r"pattern"``, which are searched in the record names.
+"""
+import re
+
+from memory_map_manager.records import record_names, span_names
+
+
+def split_override_names(override_names) -> tuple:
+    """Split override names into exact names and compiled patterns.
+
+    Example:
+        >>> split_override_names(['a', 'r"b.*"'])
+        (['a'], {'r"b.*"': re.compile('b.*')})
+
+    Return:
+        tuple: The list of exact names and the patterns by override name.
+    """
+    names = []
+    patterns = {}
+    for ovr_name in override_names:
+        if ovr_name.startswith('r"') and ovr_name.endswith('"'):
+            patterns[ovr_name] = re.compile(ovr_name[2:-1])
+        else:
+            names.append(ovr_name)
+    return names, patterns
+
+
+def match_overrides(records, override_names) -> dict:
+    """Find the indexes of the records each override of a map matches.
+
+    Exact names are looked up in an index of the record names and all
+    regular expressions are matched in a single pass over the names.
+
+    Example:
+        >>> records = [{'name': 'a[0]'}, {'name': 'a[1]'}, {'name': 'b'}]
+        >>> match_overrides(records, ['b', 'r"a"'])
+        {'b': [2], 'r"a"': [0, 1]}
+    """
+    names = list(record_names(records))
+    index = {}
+    for idx, name in enumerate(names):
+        index.setdefault(name, []).append(idx)
+    exact, patterns = split_override_names(override_names)
+    matches = {ovr_name: index.get(ovr_name, []) for ovr_name in exact}
+    if patterns:
+        matches.update(_match_patterns(names, patterns))
+    return matches
+
+
+def _match_patterns(names, patterns) -> dict:
+    """Match names against compiled patterns.
+
+    If possible the patterns are combined into one, so names that no
+    pattern matches are skipped with a single search.
+    """
+    combined = None
+    if all(pattern.groups == 0 for pattern in patterns.values()):
+        try:
+            combined = re.compile('|'.join(f'(?:{pat.pattern})'
+                                           for pat in patterns.values()))
+        except re.error:
+            combined = None
+    matches = {ovr_name: [] for ovr_name in patterns}
+    for idx, name in enumerate(names):
+        if combined is not None and not combined.search(name):
+            continue
+        for ovr_name, pattern in patterns.items():
+            if pattern.search(name):
+                matches[ovr_name].append(idx)
+    return matches
+
+
+def match_spans(records, override_names) -> bool:
+    """Check if overrides match elements of the spans of a map.
+
+    Example:
+        >>> records = [{'name': 'padding', 'span': True,
+        ...             'resolved_array_size': 4}]
+        >>> match_spans(records, ['padding[3]'])
+        True
+        >>> match_spans(records, ['padding'])
+        False
+    """
+    names, patterns = split_override_names(override_names)
+    names = {name for name in names if name.endswith(']')}
+    if not names and not patterns:
+        return False
+    for record in records:
+        if not record.get('span'):
+            continue
+        for name in span_names(record):
+            if name in names or any(pattern.search(name)
+                                    for pattern in patterns.values()):
+                return True
+    return False
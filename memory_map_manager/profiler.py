@@ -0,0 +1,140 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Wall time and peak memory of the phases of the generation."""
+import cProfile
+from contextlib import contextmanager, nullcontext
+import time
+import tracemalloc
+
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def profile_phase(profiler, name: str):
+    """Get the context of a phase, which does nothing without a profiler.
+
+    Example:
+        >>> with profile_phase(None, 'resolve_maps'):
+        ...     pass
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+
+class PhaseProfiler():
+    """Measures the wall time and peak memory of named phases.
+
+    Phases with the same name are summed up and phases can be nested. The
+    memory is traced with :mod:`tracemalloc` while the profiler is started,
+    so only Python allocations are counted and everything runs slower. Before
+    Python 3.9 the peak cannot be reset, so the peak of a phase is the peak
+    since the profiler started.
+
+    Example:
+        >>> profiler = PhaseProfiler()
+        >>> profiler.start()
+        >>> with profiler.phase('import'):
+        ...     data = list(range(1000))
+        >>> profiler.stop()
+        >>> profiler.phases['import']['calls']
+        1
+        >>> profiler.phases['import']['peak'] > 0
+        True
+    """
+
+    def __init__(self, stats_path=None):
+        """Instantiate the profiler.
+
+        Args:
+            stats_path: File to dump the :mod:`cProfile` stats of everything
+                        between :meth:`start` and :meth:`stop` to, for
+                        :mod:`pstats`. Not profiled if None.
+        """
+        self.stats_path = stats_path
+        """File the cProfile stats are dumped to."""
+
+        self.phases = {}
+        """Measurements of each phase in the order they first ran.
+
+        self.phases[name]['calls' | 'time' | 'peak']
+
+        ``time`` is the wall time in seconds and ``peak`` the most traced
+        memory in bytes while the phase ran, 0 if memory was not traced.
+        """
+
+        self._peaks = []
+        """Peak memory of each running phase before its last reset."""
+
+        self._profile = None
+        self._tracing = False
+
+    def start(self):
+        """Start tracing memory and the cProfile profiler if dumped."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.stats_path and self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        """Stop tracing and dump the cProfile stats."""
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.stats_path)
+            self._profile = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure the code run in the context as a phase."""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if self._peaks:
+                # The outer phase keeps its peak from before the reset
+                self._peaks[-1] = max(self._peaks[-1],
+                                      tracemalloc.get_traced_memory()[1])
+            self._peaks.append(0)
+            if _reset_peak is not None:
+                _reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = 0
+            if tracing:
+                peak = max(self._peaks.pop(),
+                           tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            stats = self.phases.setdefault(name, {'calls': 0, 'time': 0.0,
+                                                  'peak': 0})
+            stats['calls'] += 1
+            stats['time'] += elapsed
+            stats['peak'] = max(stats['peak'], peak)
+
+    def report(self) -> str:
+        """Get a table of the phases.
+
+        Example:
+            >>> profiler = PhaseProfiler()
+            >>> profiler.phases['import'] = {'calls': 1, 'time': 0.25,
+            ...                              'peak': 3 * 2 ** 20}
+            >>> print(profiler.report())
+            phase                          calls   time [s]  peak [MiB]
+            import                             1      0.250       3.000
+        """
+        lines = [f'{"phase":<30} {"calls":>5} {"time [s]":>10} '
+                 f'{"peak [MiB]":>11}']
+        for name, stats in self.phases.items():
+            lines.append(f'{name:<30} {stats["calls"]:>5} '
+                         f'{stats["time"]:>10.3f} '
+                         f'{stats["peak"] / 2 ** 20:>11.3f}')
+        return '\n'.join(lines)
@@ -0,0 +1,604 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Compact representations of the resolved map records."""
+from array import array
+from collections.abc import MutableMapping, Sequence
+import sys
+
+
+class _ArrayBlock():
+    """Repeats its children for each element of an array."""
+
+    __slots__ = ('uid', 'count', 'stride', 'children', 'inner_len')
+
+    def __init__(self, uid, count, stride):
+        self.uid = uid
+        self.count = count
+        self.stride = stride
+        self.children = []
+        self.inner_len = 0
+
+    def length(self) -> int:
+        """Get the amount of records of all repetitions."""
+        return self.count * self.inner_len
+
+    def find(self, index) -> tuple:
+        """Find the child holding a record index of one repetition.
+
+        Return:
+            tuple: The child and the record index within the child.
+        """
+        for child in self.children:
+            child_len = _len(child)
+            if index < child_len:
+                return child, index
+            index -= child_len
+        raise IndexError('record index out of range')
+
+
+class LazyRecords(Sequence):
+    """Records of a map where arrays are not expanded.
+
+    Only one record is stored per declaration, the record of the first
+    element of all its arrays. Each stored record carries the shape of the
+    arrays it is in, as (uid, count, stride) from the outermost array. The
+    records of the other elements are materialised on demand and are equal to
+    the records an expanded map would hold.
+    """
+
+    def __init__(self):
+        """Instantiate without records."""
+        self._root = _ArrayBlock(None, 1, 0)
+        self._pinned = {}
+
+    def append(self, record: dict, shape=()):
+        """Append the record of the first element with its array shape.
+
+        The name of the record must contain ``[0]`` for each array in the
+        shape.
+        """
+        block = self._root
+        parents = [block]
+        for uid, count, stride in shape:
+            if not block.children or \
+                    not isinstance(block.children[-1], _ArrayBlock) or \
+                    block.children[-1].uid != uid:
+                block.children.append(_ArrayBlock(uid, count, stride))
+            block = block.children[-1]
+            parents.append(block)
+        name_parts = record['name'].split('[0]', len(shape))
+        block.children.append((record, name_parts))
+        for idx, parent in enumerate(parents):
+            # Every parent gets one more leaf per repetition of the arrays
+            # below it.
+            parent.inner_len += _repeat(parents[idx + 1:])
+
+    def __len__(self):
+        """Get the amount of records of the expanded map."""
+        return self._root.inner_len
+
+    def __getitem__(self, index):
+        """Get the record of the expanded map at an index."""
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        if index in self._pinned:
+            return self._pinned[index]
+        block = self._root
+        idxs = []
+        offset = 0
+        while True:
+            child, index = block.find(index)
+            if not isinstance(child, _ArrayBlock):
+                return _materialise(child, idxs, offset)
+            idxs.append(index // child.inner_len)
+            offset += idxs[-1] * child.stride
+            index %= child.inner_len
+            block = child
+
+    def __iter__(self):
+        """Iterate over the records of the expanded map."""
+        for index, (leaf, idxs, offset) in enumerate(self._walk(self._root)):
+            if index in self._pinned:
+                yield self._pinned[index]
+            else:
+                yield _materialise(leaf, idxs, offset)
+
+    def _walk(self, block, idxs=(), offset=0):
+        for child in block.children:
+            if isinstance(child, _ArrayBlock):
+                for idx in range(child.count):
+                    yield from self._walk(child, idxs + (idx,),
+                                          offset + idx * child.stride)
+            else:
+                yield child, idxs, offset
+
+    def names(self):
+        """Iterate over the record names of the expanded map.
+
+        This does not copy any records.
+        """
+        for index, (leaf, idxs, _) in enumerate(self._walk(self._root)):
+            if index in self._pinned:
+                yield self._pinned[index]['name']
+            else:
+                yield _join_name(leaf[1], idxs)
+
+    def pin(self, index) -> dict:
+        """Materialise and store the record at an index so it can be changed.
+
+        Return:
+            dict: The stored record.
+        """
+        if index < 0:
+            index += len(self)
+        if index not in self._pinned:
+            self._pinned[index] = self[index]
+        return self._pinned[index]
+
+    def stored_records(self) -> list:
+        """Get the records that are actually stored.
+
+        These are the records of the first array elements and the pinned
+        records. Changes to a first element record apply to all elements that
+        are not pinned.
+        """
+        records = [leaf[0] for leaf in self._walk_leaves(self._root)]
+        records.extend(self._pinned.values())
+        return records
+
+    def _walk_leaves(self, block):
+        for child in block.children:
+            if isinstance(child, _ArrayBlock):
+                yield from self._walk_leaves(child)
+            else:
+                yield child
+
+
+def _len(child) -> int:
+    if isinstance(child, _ArrayBlock):
+        return child.length()
+    return 1
+
+
+def _repeat(blocks) -> int:
+    repeat = 1
+    for block in blocks:
+        repeat *= block.count
+    return repeat
+
+
+def _join_name(name_parts, idxs) -> str:
+    name = name_parts[0]
+    for idx, part in zip(idxs, name_parts[1:]):
+        name += f'[{idx}]{part}'
+    return name
+
+
+def _materialise(leaf, idxs, offset) -> dict:
+    record, name_parts = leaf
+    if not idxs:
+        return record.copy()
+    record = record.copy()
+    record['name'] = _join_name(name_parts, idxs)
+    record['map_offset'] += offset
+    return record
+
+
+def record_names(records):
+    """Iterate over the names of the records of a map."""
+    if isinstance(records, LazyRecords):
+        return records.names()
+    return (record['name'] for record in records)
+
+
+def stored_records(records):
+    """Get the records of a map that are actually stored.
+
+    Changing these records changes the map, see
+    :meth:`LazyRecords.stored_records`.
+    """
+    if isinstance(records, LazyRecords):
+        return records.stored_records()
+    return records
+
+
+def pin_record(records, index):
+    """Get the record of a map at an index so that it can be changed."""
+    if isinstance(records, LazyRecords):
+        return records.pin(index)
+    return records[index]
+
+
+def span_names(record):
+    """Iterate over the names of the elements of a span record.
+
+    Example:
+        >>> list(span_names({'name': 'padding', 'resolved_array_size': 2}))
+        ['padding[0]', 'padding[1]']
+    """
+    for idx in range(record['resolved_array_size']):
+        yield f'{record["name"]}[{idx}]'
+
+
+def expand_spans(records):
+    """Iterate over the records of a map with the spans expanded.
+
+    A span stands for all elements of a reserved array, it is replaced by the
+    records of its elements as if the array was expanded like any other, so
+    the records are the same as before spans were introduced.
+
+    Example:
+        >>> records = [{'name': 'padding', 'span': True, 'map_offset': 4,
+        ...             'resolved_array_size': 2, 'resolved_type_size': 1}]
+        >>> [(rec['name'], rec['map_offset'], 'span' in rec)
+        ...  for rec in expand_spans(records)]
+        [('padding[0]', 4, False), ('padding[1]', 5, False)]
+    """
+    for record in records:
+        if not record.get('span'):
+            yield record
+            continue
+        offset = record['map_offset']
+        for name in span_names(record):
+            element = {key: val for key, val in record.items()
+                       if key != 'span'}
+            element['name'] = name
+            element['map_offset'] = offset
+            offset += record['resolved_type_size']
+            yield element
+
+
+class _Column():
+    """Values of one record key for all rows.
+
+    Integers are stored in an ``array`` and strings as indexes into the
+    string table of the store. A column falls back to a list of objects once
+    it gets any other value.
+    """
+
+    __slots__ = ('kind', 'values')
+
+    _INT, _STR, _OBJ = 'int', 'str', 'obj'
+
+    def __init__(self, kind, length):
+        self.kind = kind
+        if kind == self._INT:
+            self.values = array('q', bytes(8 * length))
+        elif kind == self._STR:
+            self.values = array('l', [-1]) * length
+        else:
+            self.values = [None] * length
+
+    @classmethod
+    def get_kind(cls, val) -> str:
+        """Get the column kind that can store a value."""
+        if isinstance(val, int) and not isinstance(val, bool) and \
+                -2**63 <= val < 2**63:
+            return cls._INT
+        if isinstance(val, str):
+            return cls._STR
+        return cls._OBJ
+
+    def get(self, row, strings):
+        """Get the value of a row."""
+        val = self.values[row]
+        if self.kind == self._STR:
+            return strings[val]
+        return val
+
+    def set(self, row, val, store):
+        """Set the value of a row, generalising the column if needed."""
+        kind = self.get_kind(val)
+        if self.kind not in (kind, self._OBJ):
+            self.values = [self.get(idx, store.strings)
+                           for idx in range(len(self.values))]
+            self.kind = self._OBJ
+        if self.kind == self._STR:
+            val = store.intern(val)
+        self.values[row] = val
+
+    def grow(self):
+        """Add a row with an empty value."""
+        if self.kind == self._INT:
+            self.values.append(0)
+        elif self.kind == self._STR:
+            self.values.append(-1)
+        else:
+            self.values.append(None)
+
+
+class ColumnarRecords(Sequence):
+    """Records of a map stored as columns instead of dicts.
+
+    Each record key is a column holding the values of all records and each
+    string is stored once in a shared table. Every record refers to a layout,
+    the ordered keys it has. Indexing returns a :class:`RecordView` that
+    behaves like the record dict, including changing it.
+
+    Example:
+        >>> records = ColumnarRecords()
+        >>> records.append({'name': 'rec[0]', 'map_offset': 0})
+        >>> records.append({'name': 'rec[1]', 'map_offset': 4})
+        >>> records[1]['map_offset']
+        4
+        >>> records[0] == {'name': 'rec[0]', 'map_offset': 0}
+        True
+    """
+
+    def __init__(self, records=()):
+        """Instantiate with optional records."""
+        self.strings = []
+        """Table of all string values."""
+
+        self._string_ids = {}
+        self._columns = {}
+        self._layouts = []
+        self._layout_ids = {}
+        self._row_layouts = array('l')
+        for record in records:
+            self.append(record)
+
+    def intern(self, val: str) -> int:
+        """Get the index of a string in the string table, adding it if new."""
+        try:
+            return self._string_ids[val]
+        except KeyError:
+            self._string_ids[val] = len(self.strings)
+            self.strings.append(val)
+            return self._string_ids[val]
+
+    def _layout_id(self, keys) -> int:
+        keys = tuple(keys)
+        try:
+            return self._layout_ids[keys]
+        except KeyError:
+            self._layout_ids[keys] = len(self._layouts)
+            self._layouts.append(dict.fromkeys(keys))
+            return self._layout_ids[keys]
+
+    def append(self, record):
+        """Append a record."""
+        row = len(self._row_layouts)
+        self._row_layouts.append(self._layout_id(record))
+        for column in self._columns.values():
+            column.grow()
+        for key, val in record.items():
+            self.set_value(row, key, val)
+
+    def get_layout(self, row) -> dict:
+        """Get the keys of a row, as a dict to check for keys quickly."""
+        return self._layouts[self._row_layouts[row]]
+
+    def get_value(self, row, key):
+        """Get the value of a key in a row.
+
+        Raises:
+            KeyError: The row does not have the key.
+        """
+        if key not in self.get_layout(row):
+            raise KeyError(key)
+        return self._columns[key].get(row, self.strings)
+
+    def set_value(self, row, key, val):
+        """Set the value of a key in a row, adding the key if needed."""
+        layout = self.get_layout(row)
+        if key not in layout:
+            self._row_layouts[row] = self._layout_id((*layout, key))
+        if key not in self._columns:
+            self._columns[key] = _Column(_Column.get_kind(val), len(self))
+        self._columns[key].set(row, val, self)
+
+    def del_value(self, row, key):
+        """Remove a key from a row.
+
+        Raises:
+            KeyError: The row does not have the key.
+        """
+        layout = self.get_layout(row)
+        if key not in layout:
+            raise KeyError(key)
+        self._row_layouts[row] = self._layout_id(k for k in layout
+                                                 if k != key)
+
+    def __len__(self):
+        """Get the amount of records."""
+        return len(self._row_layouts)
+
+    def __getitem__(self, index):
+        """Get a view of the record at an index."""
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        return RecordView(self, index)
+
+    def __iter__(self):
+        """Iterate over views of the records, without copying them."""
+        for row in range(len(self)):
+            yield RecordView(self, row)
+
+
+class RecordView(MutableMapping):
+    """A record of :class:`ColumnarRecords` that behaves like a dict."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: ColumnarRecords, row: int):
+        """Instantiate the view of a row in a store."""
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        """Get the value of a key."""
+        return self._store.get_value(self._row, key)
+
+    def __setitem__(self, key, val):
+        """Set the value of a key."""
+        self._store.set_value(self._row, key, val)
+
+    def __delitem__(self, key):
+        """Remove a key."""
+        self._store.del_value(self._row, key)
+
+    def __contains__(self, key):
+        """Check if the record has a key."""
+        return key in self._store.get_layout(self._row)
+
+    def __iter__(self):
+        """Iterate over the keys in the order they were added."""
+        return iter(list(self._store.get_layout(self._row)))
+
+    def __len__(self):
+        """Get the amount of keys."""
+        return len(self._store.get_layout(self._row))
+
+    def __repr__(self):
+        """Represent the record like a dict."""
+        return repr(self.copy())
+
+    def copy(self) -> dict:
+        """Get the record as a new dict."""
+        return dict(self.items())
+
+
+class RecordName():
+    """Name of a record as a parent name and an interned leaf.
+
+    Records of nested typedefs share the name of their parent so only the
+    leaf is stored per record. The full dotted name is built when requested.
+
+    Example:
+        >>> parent = RecordName(RecordName(None, 'a[3]'), 'b[7]')
+        >>> str(RecordName(parent, 'c'))
+        'a[3].b[7].c'
+    """
+
+    __slots__ = ('parent', 'leaf')
+
+    def __init__(self, parent, leaf: str):
+        """Instantiate the name from a parent name or None and a leaf."""
+        self.parent = parent
+        self.leaf = sys.intern(leaf)
+
+    def __str__(self):
+        """Get the full dotted name."""
+        parts = []
+        name = self
+        while isinstance(name, RecordName):
+            parts.append(name.leaf)
+            name = name.parent
+        if name is not None:
+            parts.append(str(name))
+        return '.'.join(reversed(parts))
+
+    def __repr__(self):
+        """Represent the name as its full string."""
+        return repr(str(self))
+
+
+_DELETED = object()
+
+
+class Record(MutableMapping):
+    """A compact record that behaves like a dict.
+
+    Only the name and map offset are stored per record, other properties are
+    read from a template dict shared by all records of the same declaration.
+    Changed properties are copied to the record on write, so the template and
+    the other records are not affected.
+
+    Example:
+        >>> template = {'name': 'c', 'resolved_type': 'uint8_t'}
+        >>> rec = Record(template, RecordName(None, 'c'), 4)
+        >>> rec['description'] = 'changed'
+        >>> rec == {'name': 'c', 'resolved_type': 'uint8_t', 'map_offset': 4,
+        ...         'description': 'changed'}
+        True
+        >>> 'description' in template
+        False
+    """
+
+    __slots__ = ('_props', '_name', '_offset', '_changes')
+
+    def __init__(self, props: dict, name, map_offset: int):
+        """Instantiate from the shared properties, the name and offset."""
+        self._props = props
+        self._name = name
+        self._offset = map_offset
+        self._changes = None
+
+    def __getitem__(self, key):
+        """Get the value of a key."""
+        if key == 'name':
+            return str(self._name)
+        if key == 'map_offset':
+            return self._offset
+        if self._changes is not None and key in self._changes:
+            val = self._changes[key]
+            if val is _DELETED:
+                raise KeyError(key)
+            return val
+        return self._props[key]
+
+    def __setitem__(self, key, val):
+        """Set the value of a key without changing the shared properties."""
+        if key == 'name':
+            self._name = val
+        elif key == 'map_offset':
+            self._offset = val
+        else:
+            if self._changes is None:
+                self._changes = {}
+            self._changes[key] = val
+
+    def __delitem__(self, key):
+        """Remove a key without changing the shared properties."""
+        if key in ('name', 'map_offset') or key not in self:
+            raise KeyError(key)
+        if self._changes is None:
+            self._changes = {}
+        self._changes[key] = _DELETED
+
+    def __iter__(self):
+        """Iterate over the keys, shared keys first."""
+        changes = self._changes or {}
+        for key in self._props:
+            if changes.get(key) is not _DELETED:
+                yield key
+        if 'map_offset' not in self._props:
+            yield 'map_offset'
+        for key, val in changes.items():
+            if key not in self._props and val is not _DELETED:
+                yield key
+
+    def __len__(self):
+        """Get the amount of keys."""
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        """Represent the record like a dict."""
+        return repr(self.copy())
+
+    def copy(self) -> dict:
+        """Get the record as a new dict."""
+        return dict(self.items())
+
+    @property
+    def props(self) -> dict:
+        """The properties shared with other records."""
+        return self._props
+
+    @property
+    def changed(self) -> bool:
+        """True if the record has properties that differ from the shared."""
+        return bool(self._changes)
@@ -0,0 +1,65 @@
+# coding=utf-8
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Watches input files for changes."""
+import logging
+from os import stat
+import time
+
+
+class FileWatcher():
+    """Polls files for changes of their modification time or size.
+
+    Only the file stats are checked on each poll so watching many files stays
+    cheap.
+    """
+
+    def __init__(self, paths=None, interval=0.5):
+        """Instantiate the watcher with the files to watch."""
+        self.logger = logging.getLogger(self.__class__.__name__)
+        """Logger the this class."""
+
+        self.interval = interval
+        """Seconds to wait between polls."""
+
+        self._stamps = {}
+        self.set_paths(paths or [])
+
+    @staticmethod
+    def _get_stamp(fpath):
+        try:
+            fstat = stat(fpath)
+        except OSError:
+            return None
+        return (fstat.st_mtime_ns, fstat.st_size)
+
+    def set_paths(self, paths):
+        """Set the files to watch, keeping the state of known files."""
+        self._stamps = {str(fpath): self._stamps.get(str(fpath),
+                                                     self._get_stamp(fpath))
+                        for fpath in paths}
+
+    def poll(self) -> list:
+        """Get the files that changed since the last poll.
+
+        A file that is removed or cannot be read counts as changed.
+        """
+        changed = []
+        for fpath, old_stamp in self._stamps.items():
+            stamp = self._get_stamp(fpath)
+            if stamp != old_stamp:
+                self._stamps[fpath] = stamp
+                changed.append(fpath)
+        return changed
+
+    def wait(self) -> list:
+        """Block until at least one file changes and return the changes."""
+        while True:
+            time.sleep(self.interval)
+            changed = self.poll()
+            if changed:
+                self.logger.debug("Changed files %r", changed)
+                return changed
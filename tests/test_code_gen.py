@@ -7,6 +7,8 @@
 import os
 import shutil
 
+from memory_map_manager.watcher import FileWatcher
+
 
 def rm_r(path):
     if os.path.isdir(path) and not os.path.islink(path):
@@ -55,7 +57,53 @@ def test_cli_example_philip(script_runner):
     assert 'SUCCESS' in ret.stdout
 
 
+def test_cli_profile(script_runner, tmp_path):
+    stats = tmp_path / 'mmm.pstats'
+    ret = script_runner.run(['mmm-gen', '-p', 'examples/minimal/main.yaml',
+                             '--profile-stats', str(stats)])
+    assert ret.success
+    for phase in ('import', 'validation', 'resolve_maps', '_resolve_hashes',
+                  '_gen_typedef_type_h', 'write_files'):
+        assert f'\n{phase} ' in ret.stdout
+    assert stats.stat().st_size > 0
+
+
 def test_minimal_empty(script_runner):
     ret = script_runner.run('mmm-gen', '-p', 'tests/data/minimal_empty/main.yaml')
     assert ret.success
     assert 'SUCCESS' not in ret.stdout
+
+
+def test_cli_watch(script_runner, monkeypatch, tmp_path):
+    shutil.copy('examples/minimal/main.yaml', tmp_path)
+    shutil.copy('examples/minimal/my_minimal_map.yaml', tmp_path)
+    map_file = tmp_path / 'my_minimal_map.yaml'
+    cfg_file = tmp_path / 'main.yaml'
+    header = tmp_path / 'c_files' / 'mm_typedefs_type_1.h'
+
+    def _change_map():
+        map_file.write_text(map_file.read_text().replace('record_1',
+                                                         'record_2'))
+        return [str(map_file)]
+
+    def _change_nothing():
+        return [str(cfg_file)]
+
+    def _change_invalid():
+        map_file.write_text('invalid: true\n')
+        return [str(map_file)]
+
+    changes = iter([_change_map, _change_nothing, _change_invalid])
+
+    def _wait(self):
+        try:
+            return next(changes)()
+        except StopIteration:
+            raise KeyboardInterrupt from None
+
+    monkeypatch.setattr(FileWatcher, 'wait', _wait)
+    ret = script_runner.run(['mmm-gen', '-p', str(cfg_file), '--watch'])
+    assert ret.success
+    assert ret.stdout.count('SUCCESS') == 2
+    assert 'record_2' in header.read_text()
+    assert 'Generation failed' in ret.stderr
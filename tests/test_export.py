@@ -4,9 +4,11 @@
 # file LICENSE in the top level directory for more details.
 # SPDX-License-Identifier:    MIT
 """Tests Serial Driver implmentation in RIOT PAL."""
+from copy import deepcopy
 import pytest
 import json
 from memory_map_manager import MMMExporter
+from memory_map_manager.records import ColumnarRecords
 
 @pytest.fixture
 def map_simple_full():
@@ -3381,3 +3383,36 @@ def test_gen_full_simple(map_simple_full):
     assert len(gen.gen_c_files()) > 0
     assert len(gen.gen_csv_files()) > 0
     assert "Generated from the memory map manager version" in c_files['mm_cc.h']
+
+
+def test_gen_columnar_records(map_simple_full):
+    col_cfg = deepcopy(map_simple_full)
+    for mdata in col_cfg['maps'].values():
+        mdata['records'] = ColumnarRecords(mdata['records'])
+    gen = MMMExporter(mm_cfg=map_simple_full, mm_input_data={})
+    col_gen = MMMExporter(mm_cfg=col_cfg, mm_input_data={})
+    assert col_gen.gen_cfg_files() == gen.gen_cfg_files()
+    assert col_gen.gen_c_files() == gen.gen_c_files()
+    assert col_gen.gen_csv_files() == gen.gen_csv_files()
+
+
+def test_gen_map_cache(map_simple_full):
+    gen = MMMExporter(mm_cfg=map_simple_full, mm_input_data={})
+    files = {**gen.gen_csv_files(), **gen.gen_c_files()}
+    cfg = {**map_simple_full, 'maps': dict(map_simple_full['maps'])}
+    cfg['maps']['map_2'] = deepcopy(cfg['maps']['map_2'])
+    cfg['maps']['map_2']['records'][0]['description'] = 'changed record'
+    fresh = MMMExporter(mm_cfg=deepcopy(cfg), mm_input_data={})
+    fresh_files = fresh.gen_csv_files()
+    cached = MMMExporter(mm_cfg=cfg, mm_input_data={},
+                         map_cache=gen.map_cache)
+    assert cached.map_cache is gen.map_cache
+    new_files = {**cached.gen_csv_files(), **cached.gen_c_files()}
+    for fname, data in fresh_files.items():
+        assert new_files[fname] == data
+    reused = [fname for fname in new_files
+              if new_files[fname] is files.get(fname)]
+    assert 'mm_access_map_1.c' in reused
+    assert 'mm_default_map_1.h' in reused
+    assert all('map_2' not in fname for fname in reused)
+    assert any('changed record' in new_files[fname] for fname in fresh_files)
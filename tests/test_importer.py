@@ -13,6 +13,7 @@ import pathlib
 
 import pytest
 from jsonschema import ValidationError
+from yaml import YAMLError
 
 from memory_map_manager import MMMImporter
 
@@ -110,3 +111,104 @@ def test_error_missing_required():
 def test_error_undefined():
     with pytest.raises(ValidationError):
         _importer_file('error_undefined')
+
+
+def test_validator_cached():
+    from memory_map_manager import importer
+    mmi = MMMImporter()
+    mmi.import_map_data(_fpath('cfg_basic'))
+    schema = importer._PATH_TO_INPUT_CONFIG_SCHEMA
+    validator = importer._get_validator(schema)
+    assert validator is importer._get_validator(schema)
+    with open(_fpath('cfg_basic'), 'rb') as fhandle:
+        digest = importer.sha256(fhandle.read()).hexdigest()
+    assert (schema, digest) in importer._VALIDATED
+
+
+def test_import_map_data_jobs():
+    mmi = _importer_file('full')
+    mmi_jobs = MMMImporter(_fpath('full'), jobs=2)
+    assert mmi_jobs.mm_data == mmi.mm_data
+    assert list(mmi_jobs.mm_data) == list(mmi.mm_data)
+
+
+@pytest.mark.parametrize("jobs", [None, 2])
+def test_error_jobs(caplog, jobs):
+    mmi = MMMImporter(jobs=jobs)
+    with pytest.raises(ValidationError) as exc:
+        mmi.import_map_data([_fpath('cfg_basic'),
+                             _fpath('error_map_undefined')])
+    assert 'error_map_undefined' in caplog.text
+    assert exc.value.__notes__ == [
+        f"Failed to import {str(_fpath('error_map_undefined'))!r}"]
+
+
+def test_import_map_data_json():
+    fdir = pathlib.Path(__file__).parent.resolve()
+    mmi = MMMImporter()
+    mmi.import_map_data(pathlib.PurePath(fdir, 'data/importer',
+                                         'cfg_basic.json'))
+    mmi_yaml = MMMImporter()
+    mmi_yaml.import_map_data(_fpath('cfg_basic'))
+    assert mmi.mm_data == mmi_yaml.mm_data
+
+
+def test_import_map_data_yaml_error(tmp_path):
+    map_file = tmp_path / 'map.yaml'
+    map_file.write_text('metadata:\n  app_name: [first\n')
+    mmi = MMMImporter()
+    with pytest.raises(YAMLError) as exc:
+        mmi.import_map_data(map_file)
+    assert str(map_file) in str(exc.value)
+
+
+def test_import_map_data_msgpack(tmp_path):
+    msgpack = pytest.importorskip("msgpack")
+    fpath = tmp_path / 'cfg_basic.msgpack'
+    fpath.write_bytes(msgpack.packb({'metadata': {'app_name': 'something'}}))
+    mmi = MMMImporter()
+    mmi.import_map_data(fpath)
+    assert mmi.mm_data['metadata']['app_name'] == 'something'
+
+
+def test_cache_dir(tmp_path, monkeypatch):
+    from memory_map_manager import importer
+    mmi = MMMImporter()
+    mmi.cache_dir = str(tmp_path)
+    mmi.import_map_data(_fpath('cfg_basic'))
+    assert len(list(tmp_path.glob('*.pickle'))) == 1
+
+    def _fail_parse(fname, content):
+        raise AssertionError(f'{fname} should be cached')
+
+    monkeypatch.setattr(importer, '_parse_content', _fail_parse)
+    mmi = MMMImporter()
+    mmi.cache_dir = str(tmp_path)
+    mmi.import_map_data(_fpath('cfg_basic'))
+    assert mmi.mm_data['metadata']['app_name'] == 'something'
+
+
+def test_cache_dir_changed(tmp_path):
+    map_file = tmp_path / 'map.yaml'
+    map_file.write_text('metadata:\n  app_name: first\n')
+    cfg_file = tmp_path / 'main.yaml'
+    cfg_file.write_text('files:\n  - map.yaml\ncache_dir: cache\n')
+    mmi = MMMImporter(cfg_file)
+    assert mmi.cache_dir == str(tmp_path / 'cache')
+    assert mmi.mm_data['metadata']['app_name'] == 'first'
+    map_file.write_text('metadata:\n  app_name: second\n')
+    mmi = MMMImporter(cfg_file)
+    assert mmi.mm_data['metadata']['app_name'] == 'second'
+
+
+def test_import_map_data_unchanged(tmp_path):
+    map_file = tmp_path / 'map.yaml'
+    map_file.write_text('metadata:\n  app_name: first\n')
+    mmi = MMMImporter()
+    mmi.import_map_data(map_file)
+    data = mmi.mm_data
+    mmi.import_map_data(map_file)
+    assert mmi.mm_data['metadata']['app_name'] is data['metadata']['app_name']
+    map_file.write_text('metadata:\n  app_name: second_longer\n')
+    mmi.import_map_data(map_file)
+    assert mmi.mm_data['metadata']['app_name'] == 'second_longer'
@@ -4,9 +4,19 @@
 # file LICENSE in the top level directory for more details.
 # SPDX-License-Identifier:    MIT
 """Tests Serial Driver implmentation in RIOT PAL."""
+from copy import deepcopy
+import hashlib
 import json
+import logging
+import re
+import tracemalloc
 import pytest
-from memory_map_manager import MMMConfigParser
+from memory_map_manager import MMMConfigParser, MMMExporter
+from memory_map_manager.canonical_hash import get_canonical_hash
+from memory_map_manager.json_sem_hash import get_json_sem_hash
+from memory_map_manager.map_resolver import get_element_offsets
+from memory_map_manager.profiler import PhaseProfiler
+from memory_map_manager.records import ColumnarRecords, Record
 
 
 @pytest.fixture
@@ -15,8 +25,8 @@ def mcp() -> MMMConfigParser:
 
 
 @pytest.fixture
-def full_mcp() -> MMMConfigParser:
-    data = {'bitfields': {'bf_1': {'elements': ['field_1', 'field_2']},
+def full_data() -> dict:
+    return {'bitfields': {'bf_1': {'elements': ['field_1', 'field_2']},
                           'bf_2': {'elements': [{'bits': 12, 'name': 'field_1'}]}},
               'defines': {'def_1': 3},
               'generated_maps': {'map_1': {'type': 'type_1'},
@@ -60,7 +70,10 @@ def full_mcp() -> MMMConfigParser:
                                                   'name': 'record_1',
                                                   'type': 'type_4'}]}}}
 
-    return MMMConfigParser(data)
+
+@pytest.fixture
+def full_mcp(full_data) -> MMMConfigParser:
+    return MMMConfigParser(full_data)
 
 
 @pytest.fixture
@@ -397,6 +410,24 @@ def test_td_multi_ref(mcp: MMMConfigParser):
     assert mcp.typedefs['atd_3']['resolved_total_size'] == _tmp
 
 
+def test_td_shared_ref(mcp: MMMConfigParser):
+    data = {'td_1': {'elements': ['record_1']},
+            'td_2': {'elements': ['record_2'], 'reference': 'td_1'},
+            'td_3': {'elements': ['record_3'], 'reference': 'td_2'},
+            'td_4': {'elements': ['record_4'], 'reference': 'td_2'}}
+    mcp.resolve_typedefs(data)
+    for td_name in ['td_3', 'td_4']:
+        names = [ele['name'] for ele in mcp.typedefs[td_name]['elements']]
+        assert names == ['record_1', 'record_2', f'record_{td_name[-1]}']
+        assert 'reference' not in mcp.typedefs[td_name]
+
+
+def test_error_td_missing_ref(mcp: MMMConfigParser):
+    data = {'td_1': {'elements': ['record_1'], 'reference': 'td_missing'}}
+    with pytest.raises(KeyError):
+        mcp.resolve_typedefs(data)
+
+
 def test_td_ref(mcp: MMMConfigParser):
     data = {'td_1': {'elements': ['record_1']},
             'td_2': {'elements': ['record_2'], 'reference': 'td_1'}}
@@ -470,6 +501,8 @@ def test_td_stuct_align_fit(mcp: MMMConfigParser):
     eles = mcp.typedefs['td_1']['elements']
     td1 = mcp.typedefs['td_1']
     assert len(eles) == 1
+    # A struct ending on the border still grows by struct_align
+    assert td1['resolved_total_size'] == 8
 
 def test_td_total_size_overwrite_stuct_align(mcp: MMMConfigParser):
     mcp._struct_align = 128
@@ -500,6 +533,80 @@ def test_td_align(mcp: MMMConfigParser):
     assert eles[7]['name'] == 'padding_2'
 
 
+def test_td_padding(mcp: MMMConfigParser):
+    mcp._align = 4
+    data = {'td_1': {'elements': [{'name': 'record_1', 'type': 'uint8_t'},
+                                  {'name': 'record_2', 'type': 'uint16_t'}]},
+            'td_2': {'elements': [{'name': 'record_1', 'type': 'uint32_t'},
+                                  {'array_size': 3, 'name': 'record_2',
+                                   'type': 'td_1'}],
+                     'total_size': 32}}
+    mcp.resolve_typedefs(data)
+    assert mcp.typedef_padding['td_1'] == {'padding': 5, 'total_padding': 5,
+                                           'total_size': 8}
+    assert mcp.typedef_padding['td_2'] == {'padding': 4, 'total_padding': 19,
+                                           'total_size': 32}
+    eles = mcp.typedefs['td_2']['elements']
+    assert [ele['resolved_offset'] for ele in eles] == [0, 4, 28]
+
+
+def test_td_optimize_layout(full_data, caplog):
+    elements = [{'name': 'record_1', 'type': 'uint8_t'},
+                {'name': 'record_2', 'type': 'uint32_t'},
+                {'name': 'record_3', 'type': 'uint8_t'},
+                {'name': 'record_4', 'type': 'uint16_t'}]
+    full_data['metadata']['align'] = 4
+    full_data['typedefs']['type_1']['elements'] = elements
+    declared = MMMConfigParser(deepcopy(full_data))
+    full_data['typedefs']['type_1']['optimize_layout'] = True
+    with caplog.at_level(logging.INFO):
+        mcp = MMMConfigParser(full_data)
+    assert "'record_2', 'record_4', 'record_1', 'record_3'" in caplog.text
+    assert declared.typedef_padding['type_1']['padding'] == 8
+    assert mcp.typedef_padding['type_1']['padding'] == 0
+    assert mcp.typedef_padding['type_1']['declared_padding'] == 8
+    assert mcp.typedefs['type_1']['resolved_total_size'] == 8
+    eles = mcp.typedefs['type_1']['elements']
+    assert [ele['resolved_offset'] for ele in eles] == [0, 4, 6, 7]
+    assert mcp.typedef_hashes['type_1']['fw_hash'] != \
+        declared.typedef_hashes['type_1']['fw_hash']
+    assert mcp.get_cfg()['metadata']['fw_hash'] != \
+        declared.get_cfg()['metadata']['fw_hash']
+
+
+@pytest.mark.parametrize("total_size, padding, declared_padding",
+                         [(20, 12, 12), (12, 4, 8)])
+def test_td_optimize_layout_total_size(mcp: MMMConfigParser, total_size,
+                                       padding, declared_padding):
+    mcp._align = 4
+    data = {'td_1': {'optimize_layout': True, 'total_size': total_size,
+                     'elements': [{'name': 'record_1', 'type': 'uint8_t'},
+                                  {'name': 'record_2', 'type': 'uint32_t'},
+                                  {'name': 'record_3', 'type': 'uint8_t'},
+                                  {'name': 'record_4', 'type': 'uint16_t'}]}}
+    mcp.resolve_typedefs(data)
+    # Both layouts are filled to the total size
+    assert mcp.typedef_padding['td_1']['padding'] == padding
+    assert mcp.typedef_padding['td_1']['declared_padding'] == \
+        declared_padding
+    assert mcp.typedefs['td_1']['resolved_total_size'] == total_size
+
+
+def test_td_optimize_layout_reference(mcp: MMMConfigParser):
+    mcp._align = 4
+    data = {'td_b': {'elements': [{'name': 'a', 'type': 'uint8_t'},
+                                  {'name': 'b', 'type': 'uint32_t'}]},
+            'td_d': {'reference': 'td_b', 'optimize_layout': True,
+                     'elements': [{'name': 'c', 'type': 'uint16_t'}]}}
+    mcp.resolve_typedefs(data)
+    offsets = {td_name: [(ele['name'], ele['resolved_offset'])
+                         for ele in mcp.typedefs[td_name]['elements']]
+               for td_name in data}
+    assert offsets['td_b'] == [('a', 0), ('padding_0', 1), ('b', 4)]
+    assert offsets['td_d'] == [('b', 0), ('c', 4), ('a', 6),
+                               ('padding_0', 7)]
+
+
 def test_td_total_size(mcp: MMMConfigParser):
     data = {'td_1': {'elements': ['record_1'], 'total_size': 8}}
     mcp.resolve_typedefs(data)
@@ -536,14 +643,31 @@ def test_error_td_enum_name_conflict(mcp: MMMConfigParser):
 def test_error_td_circ(mcp: MMMConfigParser):
     data = {'td_1': {'elements': [{'name': 'record_1', 'type': 'td_2'}]},
             'td_2': {'elements': [{'name': 'record_2', 'type': 'td_1'}]}}
-    with pytest.raises(RecursionError):
+    with pytest.raises(RecursionError, match='td_1 -> td_2 -> td_1'):
         mcp.resolve_typedefs(data)
 
 
+def test_error_td_missing_type(mcp: MMMConfigParser):
+    data = {'td_1': {'elements': [{'name': 'record_1', 'type': 'td_typo'}]}}
+    with pytest.raises(RecursionError, match='td_typo'):
+        mcp.resolve_typedefs(data)
+
+
+def test_td_dependents(mcp: MMMConfigParser):
+    mcp.resolve_bitfields({'bf_1': {'elements': ['field_1']}})
+    data = {'td_1': {'elements': [{'name': 'record_1', 'type': 'bf_1'}]},
+            'td_2': {'elements': [{'name': 'record_2', 'type': 'td_1'}]},
+            'td_3': {'elements': ['record_3']}}
+    mcp.resolve_typedefs(data)
+    assert mcp.get_dependents('bf_1') == {'td_1', 'td_2'}
+    assert mcp.get_dependents('td_2') == set()
+    assert mcp.type_graph.get_deps('td_2') == {'td_1'}
+
+
 def test_error_td_circ_ref(mcp: MMMConfigParser):
     data = {'td_1': {'elements': ['record_1'], 'reference': 'td_2'},
             'td_2': {'elements': ['record_2'], 'reference': 'td_1'}}
-    with pytest.raises(RecursionError):
+    with pytest.raises(RecursionError, match='td_1 -> td_2 -> td_1'):
         mcp.resolve_typedefs(data)
 
 
@@ -591,6 +715,136 @@ def test_map_simple_full(regtest, full_mcp: MMMConfigParser):
     regtest.write(json.dumps(maps, sort_keys=True, indent=2))
 
 
+def test_map_lazy_arrays(full_data, full_mcp: MMMConfigParser):
+    lazy_mcp = MMMConfigParser(full_data, expand_arrays=False)
+    for mname, records in full_mcp.maps.items():
+        lazy = lazy_mcp.maps[mname]
+        assert len(lazy) == len(records)
+        assert list(lazy) == records
+        assert lazy[-1] == records[-1]
+        assert lazy[3:6] == records[3:6]
+        assert list(lazy.names()) == [rec['name'] for rec in records]
+        assert len(lazy.stored_records()) < len(records)
+    with pytest.raises(IndexError):
+        lazy_mcp.maps['map_1'][len(full_mcp.maps['map_1'])]
+    assert lazy_mcp.get_cfg()['metadata'] == full_mcp.get_cfg()['metadata']
+
+
+def test_map_columnar(full_data, full_mcp: MMMConfigParser):
+    col_mcp = MMMConfigParser(full_data, columnar=True)
+    assert col_mcp.get_cfg()['metadata'] == full_mcp.get_cfg()['metadata']
+    for mname, records in full_mcp.maps.items():
+        columnar = col_mcp.maps[mname]
+        assert len(columnar) == len(records)
+        assert list(columnar) == records
+        assert [list(rec) for rec in columnar] == [list(rec) for rec in records]
+        assert columnar[-1].copy() == records[-1]
+        assert columnar[2:4] == records[2:4]
+    with pytest.raises(IndexError):
+        col_mcp.maps['map_1'][len(full_mcp.maps['map_1'])]
+
+
+def test_map_columnar_changes():
+    records = ColumnarRecords([{'name': 'rec_1', 'map_offset': 0},
+                               {'name': 'rec_2', 'bits': 2}])
+    records[0]['map_offset'] = 'not a number'
+    records[0]['default'] = 1.5
+    del records[1]['bits']
+    records.append({'name': 'rec_1', 'map_offset': 2**64})
+    assert list(records) == [{'name': 'rec_1', 'map_offset': 'not a number',
+                              'default': 1.5},
+                             {'name': 'rec_2'},
+                             {'name': 'rec_1', 'map_offset': 2**64}]
+    assert records.strings.count('rec_1') == 1
+    assert 'bits' not in records[1]
+    with pytest.raises(KeyError):
+        del records[1]['bits']
+    with pytest.raises(KeyError):
+        records[1]['map_offset']
+
+
+def test_map_compact_records(full_data, full_mcp: MMMConfigParser):
+    compact_mcp = MMMConfigParser(full_data, compact_records=True)
+    assert compact_mcp.get_cfg()['metadata'] == full_mcp.get_cfg()['metadata']
+    for mname, records in full_mcp.maps.items():
+        compact = compact_mcp.maps[mname]
+        assert all(isinstance(rec, Record) for rec in compact)
+        assert compact == records
+        assert [rec.copy() for rec in compact] == records
+    rec = compact_mcp.maps['map_1'][-1]
+    props = rec.props.copy()
+    rec['description'] = 'changed'
+    del rec['resolved_type']
+    assert rec.changed and rec.props == props
+    assert rec['description'] == 'changed' and 'resolved_type' not in rec
+    with pytest.raises(KeyError):
+        del rec['resolved_type']
+    with pytest.raises(KeyError):
+        del rec['name']
+
+
+def test_map_shared_inheritance(full_data):
+    mcp = MMMConfigParser(full_data, compact_records=True)
+    records = {rec['name']: rec for rec in mcp.maps['map_2']}
+    # All instances of a nested declaration share the inherited properties
+    assert records['record_1[0].record_8[0].record_1'].props is \
+        records['record_1[1].record_8[3].record_1'].props
+    assert records['record_1[0].record_2[0]'].props is \
+        records['record_1[1].record_2[1]'].props
+
+
+@pytest.mark.parametrize("options", [{}, {'compact_records': True}])
+def test_map_typedef_instances(options):
+    data = {'generated_maps': {'map_1': {'type': 'top'}},
+            'metadata': {'app_name': 'instances'},
+            'typedefs': {'leaf': {'elements': [{'name': 'a',
+                                                'type': 'uint8_t'},
+                                               {'name': 'b',
+                                                'type': 'uint16_t',
+                                                'array_size': 2}]},
+                         'mid': {'elements': [{'name': 'l', 'type': 'leaf',
+                                               'array_size': 3},
+                                              {'name': 'x',
+                                               'type': 'uint8_t'}]},
+                         'top': {'elements': [{'name': 'm', 'type': 'mid',
+                                               'array_size': 2},
+                                              {'name': 'n', 'type': 'mid'}]}}}
+    mcp = MMMConfigParser(data, **options)
+    records = mcp.maps['map_1']
+    assert len(records) == 30
+    assert records[10]['name'] == 'm[1].l[0].a'
+    assert records[10]['map_offset'] == 16
+    assert records[29]['name'] == 'n.x'
+    assert records[29]['map_offset'] == 47
+    crecs = mcp.get_cfg()['maps']['map_1']['compressed_records']
+    assert [(rec['name'], rec['compressed_offset'],
+             [info['uid'] for info in rec.get('compressed_info', [])])
+            for rec in crecs] == [('m[n].l[m].a', '0+16*n+5*m', [1, 2]),
+                                  ('m[n].l[m].b[l]', '1+16*n+5*m+2*l',
+                                   [1, 2, 3]),
+                                  ('m[n].x', '15+16*n', [1]),
+                                  ('n.l[n].a', '32+5*n', [10]),
+                                  ('n.l[n].b[m]', '33+5*n+2*m', [10, 11]),
+                                  ('n.x', '47', [])]
+    # The strides give the offsets of all elements
+    offsets = [rec['map_offset'] for rec in records
+               if re.fullmatch(r'm\[\d\]\.l\[\d\]\.b\[\d\]', rec['name'])]
+    assert [info['stride'] for info in crecs[1]['compressed_info']] == \
+        [16, 5, 2]
+    assert get_element_offsets(crecs[1]['map_offset'],
+                               crecs[1]['compressed_info']) == offsets
+    # Loops over the arrays start and end around the compressed records
+    assert [[(info['start'], info['end'])
+             for info in rec.get('compressed_info', [])]
+            for rec in crecs] == [[(True, False), (True, False)],
+                                  [(False, False), (False, True),
+                                   (True, True)],
+                                  [(False, True)],
+                                  [(True, False)],
+                                  [(False, True), (True, True)],
+                                  []]
+
+
 def test_map_hash(full_mcp: MMMConfigParser):
     meta = full_mcp.get_cfg()['metadata']
     fh = meta['full_hash']
@@ -612,6 +866,316 @@ def test_map_hash(full_mcp: MMMConfigParser):
     assert meta['fw_hash'] != fwh
 
 
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'compact_records': True}])
+def test_map_parallel(full_data, options):
+    mcp = MMMConfigParser(full_data, **options)
+    par_mcp = MMMConfigParser(full_data, jobs=2, **options)
+    for mname in full_data['generated_maps']:
+        assert [dict(rec) for rec in par_mcp.maps[mname]] == \
+            [dict(rec) for rec in mcp.maps[mname]]
+        assert par_mcp.get_cfg()['maps'][mname]['compressed_records'] == \
+            mcp.get_cfg()['maps'][mname]['compressed_records']
+    assert par_mcp.get_cfg()['metadata'] == mcp.get_cfg()['metadata']
+    assert par_mcp.typedef_hashes == mcp.typedef_hashes
+
+
+def _get_peak_memory(data, **options) -> int:
+    tracemalloc.start()
+    try:
+        MMMConfigParser(data, **options)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _large_array_data() -> dict:
+    return {'metadata': {'app_name': 'large'},
+            'generated_maps': {'map_1': {'type': 'td_2'}},
+            'typedefs': {'td_1': {'elements': [{'name': 'record_1',
+                                                'type': 'uint8_t'},
+                                               {'name': 'record_2',
+                                                'type': 'uint16_t'}]},
+                         'td_2': {'elements': [{'array_size': 1000,
+                                                'name': 'record_1',
+                                                'type': 'td_1'}]}}}
+
+
+@pytest.fixture(scope='module')
+def expanded_peak() -> int:
+    return _get_peak_memory(_large_array_data())
+
+
+def test_lazy_peak_memory(expanded_peak):
+    lazy = _get_peak_memory(_large_array_data(), expand_arrays=False)
+    assert lazy * 3 < expanded_peak
+
+
+def test_columnar_peak_memory(expanded_peak):
+    columnar = _get_peak_memory(_large_array_data(), columnar=True)
+    assert columnar * 3 < expanded_peak * 2
+
+
+def test_profile_phases(full_data):
+    profiler = PhaseProfiler()
+    profiler.start()
+    mcp = MMMConfigParser(full_data, profiler=profiler)
+    MMMExporter(mcp.get_cfg(), profiler=profiler).gen_csv_files()
+    profiler.stop()
+    assert list(profiler.phases) == ['resolve_defines', 'resolve_metadata',
+                                     'resolve_enumerations',
+                                     'resolve_bitfields', 'resolve_typedefs',
+                                     'resolve_maps', '_resolve_overrides',
+                                     '_resolve_records_post',
+                                     '_resolve_hashes', '_gen_full_csv',
+                                     '_gen_legacy_csv', '_gen_compressed_csv',
+                                     '_gen_user_csv']
+    assert all(stats['calls'] == 1 and stats['peak'] > 0
+               for stats in profiler.phases.values())
+    assert '_resolve_hashes' in profiler.report()
+
+
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'columnar': True},
+                                     {'compact_records': True}])
+def test_map_padding_span(full_data, options):
+    full_data['typedefs']['type_4']['total_size'] = 200
+    full_data['metadata']['permission_users'] = ['user_1']
+    mcp = MMMConfigParser(full_data, **options)
+    records = mcp.maps['map_3']
+    assert len(records) == 9
+    padding = [dict(rec) for rec in records if rec.get('reserved')]
+    assert [(rec['name'], rec['map_offset'], rec['resolved_total_size'])
+            for rec in padding] == [('record_1[0].padding', 4, 196),
+                                    ('record_1[1].padding', 204, 196),
+                                    ('record_1[2].padding', 404, 196)]
+    assert all(rec['span'] for rec in padding)
+    crecs = mcp.get_cfg()['maps']['map_3']['compressed_records']
+    assert [rec['name'] for rec in crecs] == ['record_1[n].record_1[m]',
+                                              'record_1[n].padding']
+    assert crecs[1]['compressed_info'][0]['stride'] == 200
+
+    exporter = MMMExporter(mcp.get_cfg())
+    access = exporter.gen_c_files()['mm_access_map_3.c']
+    assert access.count('{.data=') == 600
+
+
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'columnar': True},
+                                     {'compact_records': True}])
+def test_map_padding_span_hash(full_data, options):
+    # Spans are hashed as their elements, the hashes are the ones from before
+    full_data['typedefs']['type_4']['total_size'] = 200
+    meta = MMMConfigParser(deepcopy(full_data), **options).get_cfg()['metadata']
+    assert meta['full_hash'] == '124e9d9bc941aeedf34b83fd1d752b46'
+    assert meta['fw_hash'] == 'edcfc7ebad65829f6db83b210d83ec75'
+    assert meta['sw_hash'] == 'e77772a7f1d15677b2a0a5a9ac4f93d8'
+
+    # Overrides of elements expand the spans of the map
+    full_data['overrides'] = {'record_1[1].padding[3]': {'description': 'x'}}
+    mcp = MMMConfigParser(full_data, **options)
+    meta = mcp.get_cfg()['metadata']
+    assert meta['full_hash'] == '44f0d4fc110e4215da753cb1ab698d77'
+    assert meta['fw_hash'] == 'edcfc7ebad65829f6db83b210d83ec75'
+    assert meta['sw_hash'] == '3afe6a8c79f46112a0eac45e659d6ef4'
+    records = [dict(rec) for rec in mcp.maps['map_3']]
+    assert len(records) == 6 + 3 * 196
+    assert not any(rec.get('span') for rec in records)
+    assert [rec['name'] for rec in records
+            if rec.get('description') == 'x'] == ['record_1[1].padding[3]']
+
+
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'columnar': True},
+                                     {'compact_records': True}])
+def test_map_reserved_span_default(min_data, options):
+    min_data['typedefs']['td_1'] = {'elements': [
+        {'name': 'res', 'type': 'uint8_t', 'array_size': 4, 'reserved': True,
+         'default': 5}]}
+    min_data['overrides'] = {'res': {'default': 7}}
+    mcp = MMMConfigParser(min_data, **options)
+    exporter = MMMExporter(mcp.get_cfg())
+    init = exporter.gen_c_files()['mm_default_map_1.c']
+    assert 'init->res =' not in init
+    assert init.count('init->res[idx] = MM_DEFAULT_MAP_1_RES;') == 2
+    assert init.count('idx < 4;') == 2
+
+
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'columnar': True},
+                                     {'compact_records': True}])
+def test_input_unchanged(full_data, options):
+    full_data['defines']['def_2'] = {'value': 'def_1 + 1'}
+    full_data['enums'] = {'enum_1': {'elements': ['a', {'name': 'b',
+                                                        'value': 'def_2'}]}}
+    full_data['typedefs']['type_6'] = {'reference': 'type_4',
+                                       'elements': [{'name': 'record_2',
+                                                     'type': 'enum_1'}]}
+    full_data['generated_maps']['map_4'] = {'type': 'type_6'}
+    full_data['overrides'] = {'record_1[0].record_1[0]': {'default': 2}}
+    expected = deepcopy(full_data)
+    mcp = MMMConfigParser(full_data, **options)
+    assert full_data == expected
+    assert mcp.typedefs['type_6']['elements'][1]['resolved_offset'] == 4
+    assert mcp.maps['map_3'][0]['default_changed']
+
+
+@pytest.mark.parametrize("options", [{'expand_arrays': False},
+                                     {'columnar': True},
+                                     {'compact_records': True}])
+def test_map_hash_algorithm(full_data, options):
+    meta = MMMConfigParser(deepcopy(full_data)).get_cfg()['metadata']
+    mcp = MMMConfigParser(deepcopy(full_data), **options)
+    assert mcp.get_cfg()['metadata']['full_hash'] == meta['full_hash']
+    assert mcp.get_cfg()['metadata']['fw_hash'] == meta['fw_hash']
+
+    full_data['metadata']['hash_algorithm'] = 'blake2b'
+    mcp = MMMConfigParser(full_data, **options)
+    for hash_name in ('full_hash', 'fw_hash', 'sw_hash'):
+        assert len(mcp.get_cfg()['metadata'][hash_name]) == 128
+        assert len(mcp.typedef_hashes['type_1'][hash_name]) == 128
+
+
+def test_canonical_hash_compat():
+    data = {'b': [1, '2', (3, None)], 'a': {"it's": 'é', 'c': 1.5}}
+    legacy = get_json_sem_hash(data)
+    assert get_canonical_hash(data) == legacy
+    assert get_canonical_hash(data, 'md5') == legacy
+    assert get_canonical_hash(data, compat=False) != legacy
+    assert get_canonical_hash({'a': 1}) == get_canonical_hash({'a': '1'})
+    assert get_canonical_hash({'a': 1}, compat=False) != \
+        get_canonical_hash({'a': '1'}, compat=False)
+    assert get_canonical_hash([(1, 2)], compat=False) == \
+        get_canonical_hash([[1, 2]], compat=False)
+    assert get_canonical_hash(data, 'blake2b', compat=False) == \
+        get_canonical_hash(deepcopy(data), hashlib.blake2b, compat=False)
+
+    assert get_canonical_hash({'a': {'b': {1: {2}}}}, compat=False) == \
+        get_canonical_hash({'a': {'b': {'1': '{2}'}}}, compat=False)
+
+    data = {'map': [{'name': f'record_{idx}', 'offset': idx, 'b': [True]}
+                    for idx in range(5000)]}
+    assert get_canonical_hash(data) == get_json_sem_hash(data)
+
+
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'compact_records': True}])
+def test_typedef_hashes(full_data, options):
+    mcp = MMMConfigParser(deepcopy(full_data), **options)
+    td_hashes = mcp.typedef_hashes
+    map_hashes = mcp.map_hashes
+    assert set(td_hashes) == set(full_data['typedefs'])
+    assert td_hashes['type_1'] != td_hashes['type_2']
+    assert td_hashes == MMMConfigParser(deepcopy(full_data)).typedef_hashes
+
+    data = deepcopy(full_data)
+    data['typedefs']['type_2']['elements'] = [{'name': 'record_1',
+                                               'description': 'changed'}]
+    mcp = MMMConfigParser(data, **options)
+    for td_name in ('type_1', 'type_2', 'type_3'):
+        assert mcp.typedef_hashes[td_name]['fw_hash'] == \
+            td_hashes[td_name]['fw_hash']
+        assert mcp.typedef_hashes[td_name]['sw_hash'] != \
+            td_hashes[td_name]['sw_hash']
+    for td_name in ('type_4', 'type_5'):
+        assert mcp.typedef_hashes[td_name] == td_hashes[td_name]
+    assert mcp.map_hashes['map_3'] == map_hashes['map_3']
+    assert mcp.map_hashes['map_1']['full_hash'] != \
+        map_hashes['map_1']['full_hash']
+
+    data = deepcopy(full_data)
+    data['overrides'] = {'record_1[0].record_1[0]': {'description': 'x'}}
+    mcp = MMMConfigParser(data, **options)
+    assert mcp.typedef_hashes == td_hashes
+    assert mcp.map_hashes['map_3']['fw_hash'] == map_hashes['map_3']['fw_hash']
+    assert mcp.map_hashes['map_3']['sw_hash'] != map_hashes['map_3']['sw_hash']
+    assert mcp.map_hashes['map_1'] == map_hashes['map_1']
+
+
+def test_resolved_steps_reused(full_data):
+    mcp = MMMConfigParser(deepcopy(full_data))
+    steps = mcp.resolved_steps
+    assert set(steps) == {'defines', 'metadata', 'maps'}
+
+    data = deepcopy(full_data)
+    data['defines'] = full_data['defines']
+    data['typedefs']['type_4']['elements'][0]['array_size'] = 3
+    new = MMMConfigParser(data, resolved_steps=steps)
+    assert new.resolved_steps['defines'] is steps['defines']
+    assert new.resolved_steps['metadata'] is steps['metadata']
+    assert new.get_cfg() == MMMConfigParser(deepcopy(data)).get_cfg()
+    assert new.get_cfg()['metadata'] != mcp.get_cfg()['metadata']
+    assert 'full_hash' not in steps['metadata'][1]['_meta']
+
+    data['defines'] = {'def_1': 4}
+    data['metadata']['version'] = '1.2.3'
+    new = MMMConfigParser(data, resolved_steps=steps)
+    assert new.resolved_steps['defines'] is not steps['defines']
+    assert new.resolved_steps['metadata'] is not steps['metadata']
+    assert new.resolved_defs['def_1'] == 4
+    assert new.get_cfg()['metadata']['major_version'] == 1
+
+
+@pytest.mark.parametrize("jobs", [None, 2])
+def test_resolved_steps_maps_reused(full_data, jobs):
+    full_data['overrides'] = {'record_1[0].record_1[1]': {'default': 5}}
+    mcp = MMMConfigParser(deepcopy(full_data), jobs=jobs)
+    steps = mcp.resolved_steps
+
+    # Only map_3 uses type_4 and it is the last map, so no uids change
+    data = deepcopy(full_data)
+    data['typedefs']['type_4']['elements'][0]['array_size'] = 3
+    new = MMMConfigParser(deepcopy(data), jobs=jobs, resolved_steps=steps)
+    assert new.maps['map_1'] is mcp.maps['map_1']
+    assert new.maps['map_2'] is mcp.maps['map_2']
+    assert new.maps['map_3'] is not mcp.maps['map_3']
+    assert new.get_cfg() == MMMConfigParser(deepcopy(data)).get_cfg()
+
+    steps = new.resolved_steps
+    data['overrides']['record_1'] = {'map': 'map_1', 'default': 7}
+    new = MMMConfigParser(deepcopy(data), jobs=jobs, resolved_steps=steps)
+    assert new.maps['map_1'] is not steps['maps']['map_1'][2]
+    assert new.maps['map_2'] is steps['maps']['map_2'][2]
+    assert new.maps['map_3'] is steps['maps']['map_3'][2]
+    assert new.get_cfg() == MMMConfigParser(deepcopy(data)).get_cfg()
+
+    # The arrays of a new first map shift the uids of all other maps
+    steps = new.resolved_steps
+    data['generated_maps'] = {'map_0': {'type': 'type_4'},
+                              **data['generated_maps']}
+    new = MMMConfigParser(deepcopy(data), jobs=jobs, resolved_steps=steps)
+    assert not any(new.maps[mname] is steps['maps'][mname][2]
+                   for mname in steps['maps'])
+    assert new.get_cfg() == MMMConfigParser(deepcopy(data)).get_cfg()
+
+
+def test_typedef_hashes_types(full_data):
+    full_data['enums'] = {'enum_1': {'elements': ['opt_1', 'opt_2']}}
+    full_data['typedefs']['type_4']['elements'].append({'name': 'record_2',
+                                                        'type': 'enum_1'})
+    mcp = MMMConfigParser(deepcopy(full_data))
+    td_hashes = mcp.typedef_hashes
+    map_hashes = mcp.map_hashes
+
+    data = deepcopy(full_data)
+    data['bitfields']['bf_2']['elements'][0]['bits'] = 10
+    mcp = MMMConfigParser(data)
+    assert mcp.typedef_hashes['type_1']['full_hash'] != \
+        td_hashes['type_1']['full_hash']
+    assert mcp.map_hashes['map_1']['full_hash'] != \
+        map_hashes['map_1']['full_hash']
+    assert mcp.typedef_hashes['type_4'] == td_hashes['type_4']
+
+    data = deepcopy(full_data)
+    data['enums']['enum_1']['elements'][1] = {'name': 'opt_2', 'value': 5}
+    mcp = MMMConfigParser(data)
+    assert mcp.typedef_hashes['type_4']['full_hash'] != \
+        td_hashes['type_4']['full_hash']
+    assert mcp.map_hashes['map_3']['full_hash'] != \
+        map_hashes['map_3']['full_hash']
+    assert mcp.typedef_hashes['type_1'] == td_hashes['type_1']
+
+
 def test_map_access_perm(regtest, mcp: MMMConfigParser):
     data = {'generated_maps': {'map_1': {'type': 'td_1'}},
             'metadata': {'app_name': 'access',
@@ -800,7 +1364,10 @@ def test_ovr_default(mcp: MMMConfigParser):
     assert mcp.maps['map_1'][1]['default'] == 1
 
 
-def test_ovr_scaled_defined_default(mcp: MMMConfigParser, min_data):
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'compact_records': True}])
+def test_ovr_scaled_defined_default(min_data, options):
+    mcp = MMMConfigParser(**options)
     rec_1 = {'name': 'record_1'}
     rec_1['array_size'] = 3
     rec_1['scaling_factor'] = 1
@@ -824,7 +1391,10 @@ def test_ovr_scaled_defined_default(mcp: MMMConfigParser, min_data):
     assert mcp.maps['map_1'][2]['resolved_scaled_max'] == 20
 
 
-def test_ovr_regex(mcp: MMMConfigParser):
+@pytest.mark.parametrize("options", [{}, {'expand_arrays': False},
+                                     {'compact_records': True}])
+def test_ovr_regex(options):
+    mcp = MMMConfigParser(**options)
     data = {'generated_maps': {'map_1': {'type': 'type_1'}},
             'metadata': {'app_name': 'minimal'},
             'overrides': {'r"record_1\\[\\d+\\]"': {'description': 'overridden'},
@@ -839,6 +1409,23 @@ def test_ovr_regex(mcp: MMMConfigParser):
     assert mcp.maps['map_1'][2]['description'] == 'specific override'
 
 
+@pytest.mark.parametrize("patterns", [['r"record_1\\[[01]\\]"', 'r"_2$"'],
+                                      ['r"(record)_1\\[[01]\\]"', 'r"_2$"'],
+                                      ['r"record_1\\[[01]\\]"', 'r"(?i)_2$"']])
+def test_ovr_regex_many(mcp: MMMConfigParser, patterns):
+    data = {'generated_maps': {'map_1': {'type': 'type_1'}},
+            'metadata': {'app_name': 'minimal'},
+            'overrides': {patterns[0]: {'description': 'first'},
+                          'record_1[1]': {'description': 'exact'},
+                          patterns[1]: {'description': 'second'}},
+            'typedefs': {'type_1': {'elements': [{'array_size': 3,
+                                                  'name': 'record_1'},
+                                                 {'name': 'record_2'}]}}}
+    mcp.resolve_all_data(data)
+    assert [rec.get('description') for rec in mcp.maps['map_1']] == \
+        ['first', 'exact', None, 'second']
+
+
 @pytest.mark.parametrize("record", ['r"no_match\\[\\d+\\]"',
                                       'no_match'])
 def test_ovr_missing(mcp: MMMConfigParser, record):
@@ -891,3 +1478,39 @@ def test_error_meta_default_map_conflict(mcp: MMMConfigParser):
     with pytest.raises(KeyError):
         mcp.resolve_all_data(data)
 
+
+def test_error_resolved_defs_circular(mcp: MMMConfigParser):
+    data = {
+        "def_1": {"value": "def_3 + 1"},
+        "def_2": {"value": "def_1 + 2"},
+        "def_3": {"value": "def_2 * 3"},
+        "def_4": {"value": "def_3"}
+    }
+    with pytest.raises(RecursionError, match='def_1 -> def_3 -> def_2 -> def_1'):
+        mcp.resolve_defines(data)
+
+
+def test_error_resolved_defs_missing(mcp: MMMConfigParser):
+    with pytest.raises(RecursionError, match='def_1'):
+        mcp.resolve_defines({"def_1": {"value": "missing + 1"}})
+
+
+@pytest.mark.parametrize("value, match", [
+    ("__import__('os')", 'can be called'), ("def_1.real", 'not allowed'),
+    ("[def_1]", 'not allowed'), ("len('ab')", 'can be called'),
+    ("def_1 << -1", 'negative shift count')])
+def test_error_resolved_defs_not_allowed(mcp: MMMConfigParser, value, match):
+    with pytest.raises(ValueError, match=match):
+        mcp.resolve_defines({"def_1": {"value": 1}, "def_2": {"value": value}})
+
+
+def test_resolved_defs_function_names(mcp: MMMConfigParser):
+    mcp.resolve_defines({"def_1": {"value": "max + 1"},
+                         "max": {"value": 4}})
+    assert mcp.resolved_defs['def_1'] == 5
+
+
+def test_resolved_defs_functions(mcp: MMMConfigParser):
+    mcp.resolve_defines({"def_1": {"value": 3},
+                         "def_2": {"value": "max(def_1, 2) * 2 // 4"}})
+    assert mcp.resolved_defs['def_2'] == 1
@@ -0,0 +1,29 @@
+# Copyright (c) 2022 Kevin Weiss, for HAW Hamburg  <kevin.weiss@haw-hamburg.de>
+#
+# This file is subject to the terms and conditions of the MIT License. See the
+# file LICENSE in the top level directory for more details.
+# SPDX-License-Identifier:    MIT
+"""Tests the file watcher used for watch mode."""
+from memory_map_manager.watcher import FileWatcher
+
+
+def test_poll(tmp_path):
+    fpath = tmp_path / 'map.yaml'
+    fpath.write_text('a: 1\n')
+    watcher = FileWatcher([fpath], interval=0)
+    assert watcher.poll() == []
+    fpath.write_text('a: 12\n')
+    assert watcher.poll() == [str(fpath)]
+    assert watcher.poll() == []
+    fpath.unlink()
+    assert watcher.wait() == [str(fpath)]
+
+
+def test_set_paths(tmp_path):
+    fpath = tmp_path / 'map.yaml'
+    fpath.write_text('a: 1\n')
+    watcher = FileWatcher(interval=0)
+    watcher.set_paths([fpath])
+    fpath.write_text('a: 12\n')
+    watcher.set_paths([fpath, tmp_path / 'missing.yaml'])
+    assert watcher.poll() == [str(fpath)]